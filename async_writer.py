@@ -0,0 +1,107 @@
+'''
+move csv/parquet writing off the parsing thread.
+
+an AsyncSink sits in front of any writer with writerows/writetuples
+(csv_convert.Writer, parquet_output.ParquetWriter, ...). rows are
+collected into batches on the parsing side and handed to a writer
+thread of their own through a bounded queue: when a writer falls behind
+the queue fills up and the parser waits, so memory stays bounded.
+'''
+
+import queue
+import threading
+
+# rows per batch handed to a writer thread
+BATCH_SIZE = 10000
+
+# batches waiting per table before the parser has to wait
+QUEUE_BATCHES = 8
+
+
+class AsyncSink(object):
+    """Writer interface that forwards batches of rows to sink in a thread"""
+
+    def __init__(self, sink, batch_size=BATCH_SIZE, queue_batches=QUEUE_BATCHES):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_batches)
+        # 'dicts' or 'tuples', the kind of rows in batch
+        self.kind = None
+        self.batch = []
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining so the parser never blocks on a dead writer
+                continue
+            kind, rows = item
+            try:
+                if kind == 'dicts':
+                    self.sink.writerows(rows)
+                else:
+                    self.sink.writetuples(rows)
+            except Exception as e:
+                self.error = e
+
+    def add(self, kind, rows):
+        if kind != self.kind:
+            self.send()
+            self.kind = kind
+        self.batch.extend(rows)
+        if len(self.batch) >= self.batch_size:
+            self.send()
+
+    def send(self):
+        if self.error is not None:
+            raise self.error
+        if self.batch:
+            # blocks while the queue is full
+            self.queue.put((self.kind, self.batch))
+            self.batch = []
+
+    def flush(self):
+        """Hand the rows collected so far to the writer thread"""
+        self.send()
+
+    def writerow(self, row):
+        self.add('dicts', [row])
+
+    def writerows(self, rows):
+        self.add('dicts', rows)
+
+    def writetuples(self, rows):
+        """Add rows that are already tuples in field order"""
+        self.add('tuples', rows)
+
+    def close(self):
+        """Send the last batch and wait until the thread has written everything"""
+        self.send()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def start_sinks(writers, batch_size=BATCH_SIZE, queue_batches=QUEUE_BATCHES):
+    """Wrap every writer of a {table: writer} dict in an AsyncSink"""
+    return {key: AsyncSink(writer, batch_size, queue_batches)
+            for key, writer in writers.items()}
+
+
+def close_sinks(sinks):
+    """Close every sink, raising the first writer error if there was one"""
+    error = None
+    for sink in sinks.values():
+        try:
+            sink.close()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
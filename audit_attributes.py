@@ -1,12 +1,19 @@
 '''let's look for faulty names'''
 
-import xml.etree.ElementTree as ET
+import csv
+import json
 import re
-import pprint
-from collections import defaultdict
+import sys
+from collections import Counter, defaultdict
+
+import parse_cache
+from updated_values import load_rules
 
 osm_file = 'SAMPLE_OSM.osm'
 
+# the cleaning rules decide which tag keys each audit looks at
+RULES = load_rules()
+
 '''STREET NAME AUDIT'''
 # check if the street name is in expected, 
 # if not, add it to street_types
@@ -18,89 +25,215 @@ expected = ['Place', 'Street', 'Crescent', 'Terrace', 'Road',
             'Medway', 'Mews', 'Parkway', 'Path', 'Rigg', 'Rise',
             'Row', 'Square', 'View', 'Walk', 'Wynd']
 
+# regex pattern to look at only the last word of the value
+street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+
 # function to look at the last word of the street name
 # and see if the name is present in the dictionary
 # if not, update the dictionary with the new word
 def audit_street_type(street_types, street_name):
-    # regex pattern to look at only the last word of the value
-    street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
     m = street_type_re.search(street_name)
     if m:
         street_type = m.group()
         if street_type not in expected:
             street_types[street_type].add(street_name)
-            
+
+# visitor for the audit engine below, called with each 'street' value
+# street_types is a dictionary of set which will contain
+# all the 'unexpected' street names
+def visit_street_name(street_types, value):
+    audit_street_type(street_types, value)
+
 def audit_street_name(filename):
-    # create a dictionary of set
-    # this will contain all the 'unexpected' street names
-    street_types = defaultdict(set)
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'node' or element.tag == 'way':
-            for tag in element.iter('tag'):
-                if tag.attrib['k'] == 'addr:street':
-                    audit_street_type(street_types, tag.attrib['v'])
-    return street_types
-
-print('faulty street names in the data: ')
-print('\n',audit_street_name(osm_file))
+    return audit_file(filename, {'street_name': AUDITS['street_name']})['street_name']
 
 '''POSTAL CODE AUDIT'''
 # postal codes in Edinburgh should be of EH# #AA format
 
+# regex pattern to search for the right postal code format
+find_postal = re.compile(RULES.rules['postcode']['format'])
+
+# faulty values repeat, so they are interned and the list holds
+# one string per distinct value, however large the file
+def visit_postal_code(faulty_post, value):
+    if not find_postal.match(value):
+        faulty_post.append(sys.intern(value))
+
 def audit_postal_code(filename):
-    # regex pattern to search for the right postal code format
-    find_postal = re.compile(r'(EH\d{1,2} \d{1}[A-Z][A-Z])')
-    faulty_post = []
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'way' or element.tag == 'node':
-            for tag in element.iter('tag'):
-                if tag.attrib['k'] == 'postal_code' or tag.attrib['k'] == 'addr:postcode':
-                    if find_postal.match(tag.attrib['v']):
-                        continue
-                    else:
-                        faulty_post.append(tag.attrib['v'])
-    return faulty_post
-
-print('faulty postcodes in the data: ')
-print('\n',audit_postal_code(osm_file))
+    return audit_file(filename, {'postal_code': AUDITS['postal_code']})['postal_code']
 
 
 '''CITY AUDIT'''
 # Find everything that is not 'Edinburgh'
 
-def audit_city(filename):
-    faulty_city = []
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'way' or element.tag == 'node':
-            for tag in element.iter('tag'):
-                if tag.attrib['k'] == 'addr:city':
-                    if tag.attrib['v'] != 'Edinburgh':
-                        if tag.attrib['v'] not in faulty_city:
-                            faulty_city.append(tag.attrib['v'])
-    return faulty_city
+expected_city = RULES.rules['city']['expected']
 
-print('faulty city names in the data: ')
-print('\n',audit_city(osm_file))
+def visit_city(faulty_city, value):
+    if value != expected_city:
+        if value not in faulty_city:
+            faulty_city.append(value)
 
+def audit_city(filename):
+    return audit_file(filename, {'city': AUDITS['city']})['city']
 
 
 '''PHONE AUDIT'''
 # find every phone number that doesn't follow the standard
 # Edinburgh phone format which is 0131 ### ####
 
+# regex pattern to search for the right phone number format
+phone_check = re.compile(RULES.rules['phone']['format'])
+
+def visit_number(faulty_number, value):
+    if not phone_check.match(value):
+        faulty_number.append(sys.intern(value))
+
 def audit_number(filename):
-    # regex pattern to search for the right phone number format
-    phone_check = re.compile(r'(0131) \d\d\d \d\d\d\d')
-    faulty_number = []
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'node' or element.tag == 'way':
-            for tag in element.iter('tag'):
-                if tag.attrib['k'] == 'contact:phone' or tag.attrib['k'] == 'phone':
-                    if phone_check.match(tag.attrib['v']):
-                        continue
-                    else:
-                        faulty_number.append(tag.attrib['v'])
-    return faulty_number
-
-print('faulty phone numbers in the data: ')
-print('\n',audit_number(osm_file))
+    return audit_file(filename, {'number': AUDITS['number']})['number']
+
+
+'''AUDIT ENGINE'''
+# every audit is registered as a visitor: the cleaning rule whose tag
+# values it checks, a function that creates an empty result, and a
+# function that is called with that result and each value of the rule.
+# all visitors share one streaming pass over the file, so the xml is
+# parsed once no matter how many audits are run
+AUDITS = {
+    'street_name': ('street', lambda: defaultdict(set), visit_street_name),
+    'postal_code': ('postcode', list, visit_postal_code),
+    'city': ('city', list, visit_city),
+    'number': ('phone', list, visit_number)
+}
+
+def audit_file(filename, audits=AUDITS, rules=RULES, backend='etree', cache_dir=None):
+    """Run every audit in a single pass and return results by audit name
+
+    backend picks the xml parser, see osm_parser.BACKENDS. With cache_dir
+    the tags are read from a parse_cache there instead of the xml.
+    """
+    results = {name: new() for name, (rule, new, visit) in audits.items()}
+    # rule name -> visitors of that rule
+    visitors = defaultdict(list)
+    for name, (rule, new, visit) in audits.items():
+        visitors[rule].append((results[name], visit))
+
+    # the parser forgets each element once it has been audited,
+    # so memory stays flat
+    for element in parse_cache.iter_elements(filename, tags=('node', 'way'),
+                                             backend=backend, cache_dir=cache_dir):
+        for tag in element.iter('tag'):
+            entry = rules.lookup(tag.attrib['k'])
+            if entry is not None:
+                for result, visit in visitors.get(entry[0], ()):
+                    visit(result, tag.attrib['v'])
+    return results
+
+'''NORMALIZATION REPORT'''
+# the audits above list faulty values once each; this report counts how
+# often every distinct raw value occurs, what the cleaners turn it into,
+# and whether the cleaned value would still fail its audit. ranking by
+# count shows which mappings would fix the most rows. the work after the
+# single pass is linear in the number of distinct values
+
+def street_type(street_name):
+    m = street_type_re.search(street_name)
+    return m.group() if m else None
+
+# rule name -> check that is True for a value which still needs work
+FAULTY_CHECKS = {
+    'street': lambda value: street_type(value) not in expected,
+    'postcode': lambda value: not find_postal.match(value),
+    'city': lambda value: value != expected_city,
+    'phone': lambda value: not phone_check.match(value)
+}
+
+def visit_count(counts, value):
+    counts[value] += 1
+
+def value_counts(filename, rules=RULES, backend='etree', cache_dir=None):
+    """Count every distinct value of every rule in one pass"""
+    audits = {name: (name, Counter, visit_count) for name in rules.rules}
+    return audit_file(filename, audits, rules, backend, cache_dir)
+
+def normalization_rows(counts, rules=RULES):
+    """One row per rule and distinct raw value, most frequent first"""
+    rows = []
+    for name in sorted(counts):
+        clean = rules.cleaners.get(name)
+        is_faulty = FAULTY_CHECKS.get(name)
+        for raw, count in counts[name].most_common():
+            cleaned = clean(raw) if clean is not None else raw
+            rows.append({'rule': name, 'raw': raw, 'cleaned': cleaned, 'count': count,
+                         'changed': cleaned != raw,
+                         'faulty': is_faulty is not None and is_faulty(cleaned)})
+    return rows
+
+def unmapped_suffixes(rows, rules=RULES, top=20):
+    """Street types that still fail the audit after cleaning and that the
+    street mapping doesn't cover, by number of rows"""
+    mapping = rules.rules['street'].get('mapping', {})
+    counts = Counter()
+    examples = defaultdict(list)
+    for row in rows:
+        if row['rule'] != 'street' or not row['faulty']:
+            continue
+        suffix = street_type(row['cleaned'])
+        if suffix is None or suffix in mapping:
+            continue
+        counts[suffix] += row['count']
+        if len(examples[suffix]) < 3:
+            examples[suffix].append(row['raw'])
+    return [{'suffix': suffix, 'count': count, 'examples': examples[suffix]}
+            for suffix, count in counts.most_common(top)]
+
+def normalization_report(rows, rules=RULES, top=20):
+    """Totals per rule with the top offenders and top changes"""
+    report = {}
+    for name in sorted(set(row['rule'] for row in rows)):
+        rule_rows = [row for row in rows if row['rule'] == name]
+        report[name] = {
+            'values': sum(row['count'] for row in rule_rows),
+            'distinct': len(rule_rows),
+            'changed': sum(row['count'] for row in rule_rows if row['changed']),
+            'faulty': sum(row['count'] for row in rule_rows if row['faulty']),
+            # values that still fail after cleaning: the mapping work to do
+            'top_offenders': [row for row in rule_rows if row['faulty']][:top],
+            'top_changes': [row for row in rule_rows if row['changed']][:top]
+        }
+    if 'street' in report:
+        report['street']['unmapped_suffixes'] = unmapped_suffixes(rows, rules, top)
+    return report
+
+def write_normalization_report(filename, json_path=None, csv_path=None,
+                               rules=RULES, top=20, backend='etree', cache_dir=None):
+    """Write the report as json and/or every counted value as csv"""
+    rows = normalization_rows(value_counts(filename, rules, backend, cache_dir), rules)
+    report = normalization_report(rows, rules, top)
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if csv_path is not None:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['rule', 'raw', 'cleaned', 'count',
+                                        'changed', 'faulty'])
+            writer.writeheader()
+            writer.writerows(rows)
+    return report
+
+def print_audits(filename, backend='etree', cache_dir=None):
+    audit_results = audit_file(filename, backend=backend, cache_dir=cache_dir)
+
+    print('faulty street names in the data: ')
+    print('\n',audit_results['street_name'])
+
+    print('faulty postcodes in the data: ')
+    print('\n',audit_results['postal_code'])
+
+    print('faulty city names in the data: ')
+    print('\n',audit_results['city'])
+
+    print('faulty phone numbers in the data: ')
+    print('\n',audit_results['number'])
+
+if __name__ == '__main__':
+    print_audits(osm_file)
@@ -0,0 +1,559 @@
+'''
+benchmarks for the conversion pipeline on a synthetic osm file
+'''
+
+import collections
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import csv_convert
+import osm_parser
+import sqlite_load
+import updated_values
+
+# every run of bench_suite is appended to this file as one line of json
+RESULTS_PATH = 'benchmark_results.jsonl'
+
+# tag values the cleaners leave alone, and values they (or the audits) flag
+CLEAN_STREETS = ['Princes Street', 'Leith Walk', 'Mayburn Avenue',
+                 'Logie Green Road', 'St James Place']
+DIRTY_STREETS = ['Mayburn Ave', 'Logie Green Rd', 'St James place',
+                 'Duddingston Gardens North', 'Railway Path South', 'Bread Street court']
+CLEAN_CITIES = ['Edinburgh']
+DIRTY_CITIES = ['Ed', 'Penicuick', 'Musselburgh']
+CLEAN_PHONES = ['0131 447 9027', '0131 556 1234', '0131 654 2777']
+DIRTY_PHONES = ['+44 131 447 9027', '+44 (0)131 656 0390', '01316542777',
+                '+44 788 983 2780', '+44 131 5525522', '+44 131-226-6665']
+CLEAN_POSTCODES = ['EH1 1YZ', 'EH12 5AB', 'EH6 7DX']
+DIRTY_POSTCODES = ['EH11YZ', 'eh12 5ab', 'EH6']
+
+
+def pick(rand, clean, dirty, dirty_ratio):
+    if rand.random() < dirty_ratio:
+        return rand.choice(dirty)
+    return rand.choice(clean)
+
+
+# the address tags of one element, with about dirty_ratio of the values
+# in need of cleaning
+def address_tags(rand, dirty_ratio=0.5):
+    return [('addr:street', pick(rand, CLEAN_STREETS, DIRTY_STREETS, dirty_ratio)),
+            ('addr:city', pick(rand, CLEAN_CITIES, DIRTY_CITIES, dirty_ratio)),
+            ('addr:postcode', pick(rand, CLEAN_POSTCODES, DIRTY_POSTCODES, dirty_ratio)),
+            ('phone', pick(rand, CLEAN_PHONES, DIRTY_PHONES, dirty_ratio))]
+
+
+# write a reproducible osm file with n_nodes nodes, n_ways ways and
+# n_relations relations of up to max_members members each.
+# tag_density is the share of nodes with address tags, dirty_ratio the
+# share of street/city/postcode/phone values that need cleaning
+def write_synthetic_osm(filename, n_nodes, n_ways, seed=0, n_relations=0,
+                        max_members=50, tag_density=0.25, dirty_ratio=0.5):
+    rand = random.Random(seed)
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<osm version="0.6" generator="benchmark">\n')
+        for i in range(1, n_nodes + 1):
+            f.write(' <node id="{}" lat="{:.7f}" lon="{:.7f}" version="1" '
+                    'timestamp="2017-07-01T12:00:00Z" changeset="{}" '
+                    'uid="{}" user="user{}"'.format(
+                        i, 55.9 + rand.random() * 0.1, -3.3 + rand.random() * 0.2,
+                        rand.randint(1, 5000), i % 100, i % 100))
+            if rand.random() < tag_density:
+                f.write('>\n')
+                for k, v in address_tags(rand, dirty_ratio):
+                    f.write('  <tag k="{}" v="{}"/>\n'.format(k, v))
+                f.write('  <tag k="source" v="Bing"/>\n')
+                f.write(' </node>\n')
+            else:
+                f.write('/>\n')
+        for i in range(1, n_ways + 1):
+            f.write(' <way id="{}" version="1" timestamp="2017-07-01T12:00:00Z" '
+                    'changeset="{}" uid="{}" user="user{}">\n'.format(
+                        n_nodes + i, rand.randint(1, 5000), i % 100, i % 100))
+            for j in range(rand.randint(2, 12)):
+                f.write('  <nd ref="{}"/>\n'.format(rand.randint(1, n_nodes)))
+            f.write('  <tag k="highway" v="residential"/>\n')
+            f.write('  <tag k="addr:street" v="{}"/>\n'.format(
+                pick(rand, CLEAN_STREETS, DIRTY_STREETS, dirty_ratio)))
+            f.write(' </way>\n')
+        for i in range(1, n_relations + 1):
+            f.write(' <relation id="{}" version="1" timestamp="2017-07-01T12:00:00Z" '
+                    'changeset="{}" uid="{}" user="user{}">\n'.format(
+                        i, rand.randint(1, 5000), i % 100, i % 100))
+            for j in range(rand.randint(1, max_members)):
+                if rand.random() < 0.8:
+                    f.write('  <member type="way" ref="{}" role="outer"/>\n'.format(
+                        n_nodes + rand.randint(1, max(n_ways, 1))))
+                else:
+                    f.write('  <member type="node" ref="{}" role="stop"/>\n'.format(
+                        rand.randint(1, n_nodes)))
+            f.write('  <tag k="type" v="route"/>\n')
+            f.write('  <tag k="route" v="bus"/>\n')
+            f.write(' </relation>\n')
+        f.write('</osm>\n')
+
+
+@contextlib.contextmanager
+def temp_workdir():
+    """Run in a new temporary directory, removed with its files afterwards
+
+    Works as a decorator too: every call of a function decorated with
+    @temp_workdir() gets a directory of its own.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(cwd)
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def read_outputs():
+    outputs = []
+    for path in csv_convert.CSV_PATHS:
+        with open(path, 'rb') as f:
+            outputs.append(f.read())
+    return outputs
+
+
+# compare serial process_map against the sharded process pool
+@temp_workdir()
+def bench_parallel(n_nodes=200000, n_ways=40000, processes=(2, 4, 8)):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    serial = timed(csv_convert.process_map, 'bench.osm', validate=False)
+    expected = read_outputs()
+    print('serial: {:.2f}s'.format(serial))
+
+    for n in processes:
+        elapsed = timed(csv_convert.process_map, 'bench.osm', validate=False,
+                        processes=n)
+        same = read_outputs() == expected
+        print('{} processes: {:.2f}s ({:.1f}x, identical output: {})'.format(
+            n, elapsed, serial / elapsed, same))
+
+
+# the old two step route: write the csv(s), then .import them with the sqlite3 shell
+def csv_then_import(file_in, db_path):
+    csv_convert.process_map(file_in, validate=False)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    script = [sqlite_load.TABLES_SQL, '.mode csv']
+    for key, path in zip(['node', 'node_tags', 'way', 'way_nodes', 'way_tags'],
+                         csv_convert.CSV_PATHS):
+        script.append('.import --skip 1 {} {}'.format(path, sqlite_load.TABLE_NAMES[key]))
+    script.append(sqlite_load.INDEXES_SQL)
+    subprocess.run(['sqlite3', db_path], input='\n'.join(script).encode('utf-8'),
+                   check=True)
+
+
+# compare csv + .import against loading the database directly
+@temp_workdir()
+def bench_sqlite(n_nodes=200000, n_ways=40000):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    two_step = timed(csv_then_import, 'bench.osm', 'import.db')
+    direct = timed(csv_convert.process_map, 'bench.osm', validate=False,
+                   db_path='direct.db')
+    print('csv + .import: {:.2f}s'.format(two_step))
+    print('direct load:   {:.2f}s ({:.1f}x)'.format(direct, two_step / direct))
+
+
+# runs in a fresh process so ru_maxrss is the peak of this backend only
+def parse_only(args):
+    filename, backend = args
+    start = time.time()
+    count = 0
+    for element in osm_parser.iter_elements(filename, backend=backend):
+        count += 1
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return count, elapsed, peak
+
+
+# elements/sec and peak memory of each parser backend
+@temp_workdir()
+def bench_parsers(n_nodes=1000000, n_ways=200000):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    for backend in sorted(osm_parser.BACKENDS):
+        if backend == 'lxml' and osm_parser.lxml_etree is None:
+            print('{}: not installed'.format(backend))
+            continue
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            count, elapsed, peak = pool.apply(parse_only, [('bench.osm', backend)])
+        finally:
+            pool.close()
+            pool.join()
+        print('{}: {:.0f} elements/sec, peak rss {:.1f} MB'.format(
+            backend, count / elapsed, peak))
+
+
+# conversion time and peak memory of a relation heavy extract
+@temp_workdir()
+def bench_relations(n_nodes=100000, n_ways=20000, n_relations=20000,
+                    max_members=500):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways, n_relations=n_relations,
+                        max_members=max_members)
+
+    for backend in ['etree', 'expat']:
+        elapsed = timed(csv_convert.process_map, 'bench.osm', validate=False,
+                        backend=backend)
+        with open(csv_convert.RELATION_MEMBERS_PATH, 'rb') as f:
+            members = sum(1 for line in f) - 1
+        print('{}: {:.2f}s, {:.0f} relation members/sec'.format(
+            backend, elapsed, members / elapsed))
+    # the peak over the whole run, so it covers the largest relation
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print('peak rss {:.1f} MB'.format(peak))
+
+
+# disk size and top contributors scan time, csv against parquet
+@temp_workdir()
+def bench_parquet(n_nodes=1000000, n_ways=200000):
+    import parquet_output
+    if parquet_output.pa is None:
+        print('parquet: pyarrow not installed')
+        return
+    import pyarrow.parquet as pq
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    csv_time = timed(csv_convert.process_map, 'bench.osm', validate=False)
+    parquet_time = timed(csv_convert.process_map, 'bench.osm', validate=False,
+                         parquet_dir='parquet')
+    csv_size = sum(os.path.getsize(path) for path in csv_convert.CSV_PATHS)
+    parquet_size = sum(os.path.getsize(os.path.join('parquet', name))
+                       for name in os.listdir('parquet'))
+    print('convert: csv {:.2f}s, parquet {:.2f}s'.format(csv_time, parquet_time))
+    print('size: csv {:.1f} MB, parquet {:.1f} MB ({:.1f}x smaller)'.format(
+        csv_size / 1e6, parquet_size / 1e6, float(csv_size) / parquet_size))
+
+    def top_users_csv():
+        users = collections.Counter()
+        for path in [csv_convert.NODES_PATH, csv_convert.WAYS_PATH]:
+            with open(path) as f:
+                reader = csv.DictReader(f)
+                users.update(row['user'] for row in reader)
+        return users.most_common(10)
+
+    def top_users_parquet():
+        users = collections.Counter()
+        for name in ['nodes', 'ways']:
+            column = pq.read_table(os.path.join('parquet', name + '.parquet'),
+                                   columns=['user']).column('user')
+            counts = column.value_counts()
+            users.update(dict(zip(counts.field('values').to_pylist(),
+                                  counts.field('counts').to_pylist())))
+        return users.most_common(10)
+
+    same = top_users_csv() == top_users_parquet()
+    csv_scan = timed(top_users_csv)
+    parquet_scan = timed(top_users_parquet)
+    print('top users: csv {:.2f}s, parquet {:.3f}s ({:.0f}x, same result: {})'.format(
+        csv_scan, parquet_scan, csv_scan / parquet_scan, same))
+
+
+# the length of every way from a join of way_nodes with nodes, as
+# before the way geometry stage (sqlite has the math functions since 3.35)
+LONGEST_WAYS_JOIN_SQL = '''
+SELECT a.id, SUM(6371008.8 * 2 * asin(sqrt(
+    power(sin(radians(m.lat - n.lat) / 2), 2) +
+    cos(radians(n.lat)) * cos(radians(m.lat)) *
+    power(sin(radians(m.lon - n.lon) / 2), 2)))) AS length
+FROM way_nodes a JOIN way_nodes b ON b.id = a.id AND b.position = a.position + 1
+JOIN nodes n ON n.id = a.node_id JOIN nodes m ON m.id = b.node_id
+GROUP BY a.id ORDER BY length DESC LIMIT 10
+'''
+
+
+# cost of the way geometry stage, and the longest ways query with and without it
+@temp_workdir()
+def bench_geometry(n_nodes=1000000, n_ways=200000):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    plain = timed(csv_convert.process_map, 'bench.osm', validate='fast',
+                  db_path='plain.db')
+    enriched = timed(csv_convert.process_map, 'bench.osm', validate='fast',
+                     db_path='geometry.db', geometry=True)
+    print('conversion: {:.2f}s, with geometry {:.2f}s (+{:.1%})'.format(
+        plain, enriched, enriched / plain - 1))
+
+    connection = sqlite3.connect('geometry.db')
+    join = timed(lambda: connection.execute(LONGEST_WAYS_JOIN_SQL).fetchall())
+    table = timed(lambda: connection.execute(
+        'SELECT id, length FROM way_geometry ORDER BY length DESC LIMIT 10').fetchall())
+    print('longest ways: join {:.2f}s, way_geometry {:.3f}s'.format(join, table))
+
+
+# the key and type counts of the writeup, on the plain and the encoded tables
+TAG_COUNT_QUERIES = {
+    'top keys': ('''
+        SELECT key, COUNT(*) AS num FROM (
+            SELECT key FROM node_tags UNION ALL SELECT key FROM way_tags)
+        GROUP BY key ORDER BY num DESC, key LIMIT 10''', '''
+        SELECT tag_keys.key, num FROM (
+            SELECT key_id, COUNT(*) AS num FROM (
+                SELECT key_id FROM node_tags UNION ALL SELECT key_id FROM way_tags)
+            GROUP BY key_id) JOIN tag_keys ON tag_keys.id = key_id
+        ORDER BY num DESC, tag_keys.key LIMIT 10'''),
+    'types': ('''
+        SELECT type, COUNT(*) AS num FROM (
+            SELECT type FROM node_tags UNION ALL SELECT type FROM way_tags)
+        GROUP BY type ORDER BY num DESC, type''', '''
+        SELECT tag_types.type, num FROM (
+            SELECT type_id, COUNT(*) AS num FROM (
+                SELECT type_id FROM node_tags UNION ALL SELECT type_id FROM way_tags)
+            GROUP BY type_id) JOIN tag_types ON tag_types.id = type_id
+        ORDER BY num DESC, tag_types.type'''),
+    'top users': ('''
+        SELECT user, COUNT(*) AS num FROM (
+            SELECT user FROM nodes UNION ALL SELECT user FROM ways)
+        GROUP BY user ORDER BY num DESC, user LIMIT 10''', '''
+        SELECT users.user, num FROM (
+            SELECT user_id, COUNT(*) AS num FROM (
+                SELECT user_id FROM nodes UNION ALL SELECT user_id FROM ways)
+            GROUP BY user_id) JOIN users ON users.id = user_id
+        ORDER BY num DESC, users.user LIMIT 10''')
+}
+
+
+# size of the plain and the dictionary encoded database, and the speed
+# of the writeup's GROUP BY queries on each
+@temp_workdir()
+def bench_dictionary(n_nodes=1000000, n_ways=200000):
+    write_synthetic_osm('bench.osm', n_nodes, n_ways)
+
+    plain = timed(csv_convert.process_map, 'bench.osm', validate='fast',
+                  db_path='plain.db')
+    encoded = timed(csv_convert.process_map, 'bench.osm', validate='fast',
+                    db_path='encoded.db', dictionary=True)
+    print('conversion: plain {:.2f}s, encoded {:.2f}s'.format(plain, encoded))
+
+    plain_connection = sqlite3.connect('plain.db')
+    encoded_connection = sqlite3.connect('encoded.db')
+    # the summary tables of the plain database aren't in the encoded one
+    plain_connection.executescript('DROP TABLE IF EXISTS tag_counts; '
+                                   'DROP TABLE IF EXISTS user_counts; '
+                                   'DROP TABLE IF EXISTS table_counts; '
+                                   'DROP INDEX IF EXISTS node_tags_key; '
+                                   'DROP INDEX IF EXISTS way_tags_key; VACUUM;')
+    plain_size = os.path.getsize('plain.db')
+    encoded_size = os.path.getsize('encoded.db')
+    print('size: plain {:.1f} MB, encoded {:.1f} MB ({:.1f}x smaller)'.format(
+        plain_size / 1e6, encoded_size / 1e6, plain_size / encoded_size))
+    for table in ['node_tags', 'way_tags', 'nodes', 'ways']:
+        plain_bytes, = plain_connection.execute(
+            'SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (table,)).fetchone()
+        encoded_bytes, = encoded_connection.execute(
+            'SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (table,)).fetchone()
+        print('  {}: {:.1f} MB -> {:.1f} MB'.format(
+            table, plain_bytes / 1e6, encoded_bytes / 1e6))
+
+    for name, (plain_sql, encoded_sql) in TAG_COUNT_QUERIES.items():
+        expected = plain_connection.execute(plain_sql).fetchall()
+        same = encoded_connection.execute(encoded_sql).fetchall() == expected
+        plain_time = min(timed(lambda: plain_connection.execute(plain_sql).fetchall())
+                         for _ in range(3))
+        encoded_time = min(timed(lambda: encoded_connection.execute(encoded_sql).fetchall())
+                           for _ in range(3))
+        print('{}: plain {:.3f}s, encoded {:.3f}s ({:.1f}x, same result: {})'.format(
+            name, plain_time, encoded_time, plain_time / encoded_time, same))
+
+
+# runs in a fresh process so ru_maxrss is the peak of this entry point only
+def peak_memory(args):
+    filename, entry, limit_mb = args
+    import audit_attributes
+    import key_profile
+    if entry == 'process_map':
+        csv_convert.process_map(filename, validate='fast', memory_limit_mb=limit_mb)
+    elif entry == 'process_map_sqlite':
+        csv_convert.process_map(filename, validate='fast', db_path='bench.db',
+                                memory_limit_mb=limit_mb)
+    elif entry == 'profile_keys':
+        key_profile.profile_keys(filename)
+    elif entry == 'audit_file':
+        audit_attributes.audit_file(filename)
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+MEMORY_ENTRIES = ['profile_keys', 'audit_file', 'process_map', 'process_map_sqlite']
+
+
+# peak rss in MB of one entry point on filename, run in a process of its own;
+# spawned rather than forked, so none of the caller's memory is counted
+def measure_peak(filename, entry, limit_mb):
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    try:
+        return pool.apply(peak_memory, [(filename, entry, limit_mb)])
+    finally:
+        pool.close()
+        pool.join()
+
+
+# peak memory of each entry point on an extract and on one 10x its size;
+# with every element forgotten after use the two peaks should be about equal
+@temp_workdir()
+def bench_memory(n_nodes=50000, n_ways=10000, n_relations=500, growth=10,
+                 limit_mb=200, entries=MEMORY_ENTRIES):
+    write_synthetic_osm('small.osm', n_nodes, n_ways, n_relations=n_relations)
+    write_synthetic_osm('large.osm', n_nodes * growth, n_ways * growth,
+                        n_relations=n_relations * growth)
+
+    results = {}
+    for entry in entries:
+        peaks = [measure_peak(filename, entry, limit_mb)
+                 for filename in ['small.osm', 'large.osm']]
+        results[entry] = peaks
+        print('{}: peak rss {:.1f} MB, {:.1f} MB at {}x the input ({:+.1f}%)'.format(
+            entry, peaks[0], peaks[1], growth, (peaks[1] / peaks[0] - 1) * 100))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# best and mean of repeat runs, and items/sec of the best one
+def measure(function, items, repeat):
+    times = [timed(function) for _ in range(repeat)]
+    best = min(times)
+    return {'best': best, 'mean': sum(times) / len(times), 'items': items,
+            'items_per_sec': items / best if best else None}
+
+
+# time every stage of the project on one synthetic file and append the
+# results, with the config and git revision, to results_path
+def bench_suite(results_path=RESULTS_PATH, n_nodes=200000, n_ways=40000,
+                n_relations=2000, tag_density=0.25, dirty_ratio=0.5, seed=0,
+                repeat=3):
+    results_path = os.path.abspath(results_path)
+    config = {'n_nodes': n_nodes, 'n_ways': n_ways, 'n_relations': n_relations,
+              'tag_density': tag_density, 'dirty_ratio': dirty_ratio,
+              'seed': seed, 'repeat': repeat}
+    with temp_workdir():
+        write_synthetic_osm('bench.osm', n_nodes, n_ways, seed, n_relations,
+                            tag_density=tag_density, dirty_ratio=dirty_ratio)
+        elements = n_nodes + n_ways + n_relations
+
+        import audit_attributes
+        import count_tags
+        import parse_cache
+        import tag_pattern
+        # build the parse cache once, so the cached case only reads it
+        parse_cache.ensure('bench.osm', parse_cache.CACHE_DIR)
+
+        rand = random.Random(seed)
+        tags = [tag for _ in range(n_nodes) for tag in address_tags(rand, dirty_ratio)]
+        streets = [v for k, v in tags if k == 'addr:street']
+        cities = [v for k, v in tags if k == 'addr:city']
+        phones = [v for k, v in tags if k == 'phone']
+
+        def clean_tags():
+            # fresh rules, so every run starts with empty caches
+            clean = updated_values.load_rules().clean
+            for k, v in tags:
+                clean(k, v)
+
+        cases = [
+            ('count_tags', elements, lambda: count_tags.count_tags('bench.osm')),
+            ('tag_patterns', elements, lambda: tag_pattern.tag_patterns('bench.osm')),
+            ('key_pattern_count', elements, lambda: tag_pattern.key_pattern_count(
+                'bench.osm', dict.fromkeys(['lower', 'lower_colon', 'problemchars',
+                                            'other'], 0))),
+            ('audit_file', elements, lambda: audit_attributes.audit_file('bench.osm')),
+            ('audit_file_cached', elements, lambda: audit_attributes.audit_file(
+                'bench.osm', cache_dir=parse_cache.CACHE_DIR)),
+            ('update_street', len(streets), lambda: [
+                updated_values.update_street(v, updated_values.street_mapping)
+                for v in streets]),
+            ('update_city', len(cities), lambda: [
+                updated_values.update_city(v, updated_values.city_mapping)
+                for v in cities]),
+            ('update_number', len(phones), lambda: [
+                updated_values.update_number(v) for v in phones]),
+            ('update_numbers', len(phones), lambda: updated_values.update_numbers(phones)),
+            ('rules_clean', len(tags), clean_tags),
+            ('process_map', elements, lambda: csv_convert.process_map(
+                'bench.osm', validate=False)),
+            ('process_map_fast_validation', elements, lambda: csv_convert.process_map(
+                'bench.osm', validate='fast'))
+        ]
+        results = {}
+        for name, items, function in cases:
+            results[name] = measure(function, items, repeat)
+            print('{}: {:.3f}s, {:.0f} items/sec'.format(
+                name, results[name]['best'], results[name]['items_per_sec']))
+
+        record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'revision': git_revision(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'config': config,
+                  'results': results}
+        with open(results_path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+        return record
+
+
+def read_results(results_path=RESULTS_PATH):
+    with open(results_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# (name, old best, new best) of every benchmark that got more than
+# threshold slower since the last run with the same config
+def find_regressions(results_path=RESULTS_PATH, threshold=0.1):
+    runs = read_results(results_path)
+    if not runs:
+        return []
+    latest = runs[-1]
+    earlier = [run for run in runs[:-1] if run['config'] == latest['config']]
+    if not earlier:
+        return []
+    previous = earlier[-1]['results']
+    regressions = []
+    for name, result in sorted(latest['results'].items()):
+        if name in previous and result['best'] > previous[name]['best'] * (1 + threshold):
+            regressions.append((name, previous[name]['best'], result['best']))
+    return regressions
+
+
+if __name__ == '__main__':
+    bench_suite()
+    for name, old, new in find_regressions():
+        print('regression: {} {:.3f}s -> {:.3f}s'.format(name, old, new))
+    bench_parallel()
+    bench_sqlite()
+    bench_parsers()
+    bench_relations()
+    bench_parquet()
+    bench_geometry()
+    bench_dictionary()
+    bench_memory()
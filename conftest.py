@@ -0,0 +1,15 @@
+import pytest
+
+from benchmark import write_synthetic_osm
+
+
+@pytest.fixture
+def osm_file(tmp_path, monkeypatch):
+    """A small synthetic extract in a fresh working directory
+
+    The conversions write their csv(s) to the working directory, so every
+    test runs in its own tmp_path.
+    """
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_osm('test.osm', 2000, 400, seed=1, n_relations=30)
+    return 'test.osm'
@@ -1,16 +1,15 @@
-import xml.etree.ElementTree as ET
 import pprint
 
+from key_profile import profile_keys
+
 osm_file = 'SAMPLE_OSM.osm'
 
 # see the tags within the file and count tags
-def count_tags(filename):
-    tag_dict = {}
-    for event, element in ET.iterparse(filename):
-        if element.tag not in tag_dict:
-            tag_dict[element.tag] = 1
-        elif element.tag in tag_dict:
-            tag_dict[element.tag] += 1
-    return tag_dict
+# with cache_dir the counts come from a parse_cache there
+def count_tags(filename, profile=None, cache_dir=None):
+    if profile is None:
+        profile = profile_keys(filename, cache_dir=cache_dir)
+    return dict(profile.element_counts)
 
-print(count_tags(osm_file))
+if __name__ == '__main__':
+    print(count_tags(osm_file))
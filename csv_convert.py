@@ -1,14 +1,27 @@
 import unicodecsv as csv
 import codecs
+import json
+import multiprocessing
+import os
+import pprint
+import shutil
+import sys
 from unittest import TestCase
 import re
-import xml.etree.ElementTree as ET
 
+import async_writer
 import cerberus
+import dictionary_encoding
+import fast_validation
+import memory_budget
+import osm_parser
 import schema
+import sqlite_load
+import way_geometry
+from node_store import NodeStore, RelationMembers, WayNodes, merge_stores
 
 # import cleaning functions
-from updated_values import no_directions, update_street, update_city, update_number
+from updated_values import load_rules, cache_report
 
 OSM_PATH = 'edinburgh_scotland.osm'
 
@@ -17,26 +30,59 @@ NODE_TAGS_PATH ='node_tags.csv'
 WAYS_PATH = 'ways.csv'
 WAY_TAGS_PATH = 'way_tags.csv'
 WAY_NODES_PATH = 'way_nodes.csv'
+RELATIONS_PATH = 'relations.csv'
+RELATION_TAGS_PATH = 'relation_tags.csv'
+RELATION_MEMBERS_PATH = 'relation_members.csv'
+WAY_GEOMETRY_PATH = 'way_geometry.csv'
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+', re.IGNORECASE)
 PROBLEMCHARS = re.compile(r'^[=\+/&<>;\'"?%#$@\,\. \t\r\n]', re.IGNORECASE)
 
-street_mapping = {
-    'Ave': 'Avenue',
-    'Ave.': 'Avenue',
-    'Bildings': 'Buildings',
-    'Rd' : 'Road',
-    'court': 'Court',
-    'place': 'Place',
-    'Pl': 'Place'
-}
+# tag cleaning rules; every tag value goes through RULES.clean
+RULES = load_rules()
 
-city_mapping = {
-    'Ed': 'Edinburgh',
-    'Penicuick': 'Penicuik'
+# schema.py covers nodes and ways; the relation tables are added here
+RELATION_SCHEMA = {
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'type': {'required': True, 'type': 'string',
+                         'allowed': ['node', 'way', 'relation']},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    }
 }
 
-SCHEMA = schema.schema
+SCHEMA = dict(schema.schema, **RELATION_SCHEMA)
 
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version',
               'changeset', 'timestamp']
@@ -45,13 +91,21 @@ WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset',
              'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset',
+                  'timestamp']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'type', 'role', 'position']
+WAY_GEOMETRY_FIELDS = way_geometry.WAY_GEOMETRY_FIELDS
 
 def shape_element(element, node_attr_fields = NODE_FIELDS, way_attr_fields = WAY_FIELDS,
-                  problem_chars = PROBLEMCHARS, default_tag_type = 'regular'):
+                  problem_chars = PROBLEMCHARS, default_tag_type = 'regular', clean = None):
     
+    # clean is RULES.clean unless a profiler is timing it
+    if clean is None:
+        clean = RULES.clean
     node_attribs = {}
     way_attribs = {}
-    way_nodes = []
+    way_nodes = None
     tags = []
     
     
@@ -70,12 +124,7 @@ def shape_element(element, node_attr_fields = NODE_FIELDS, way_attr_fields = WAY
         # filing in for node_tags
         # cleaning tag values
         for tag in element:
-            if tag.attrib['k'] == 'addr:street':
-                tag.attrib['v'] = update_street(tag.attrib['v'], street_mapping)
-            elif tag.attrib['k'] == 'addr:city':
-                tag.attrib['v'] = update_city(tag.attrib['v'], city_mapping)
-            elif tag.attrib['k'] == 'phone' or tag.attrib['k'] == 'contact:phone':
-                tag.attrib['v'] = update_number(tag.attrib['v'])
+            tag.attrib['v'] = clean(tag.attrib['k'], tag.attrib['v'])
             
             node_tags = {}
             # ignore tags if it contains problemchars
@@ -111,25 +160,15 @@ def shape_element(element, node_attr_fields = NODE_FIELDS, way_attr_fields = WAY
                     way_attrbs[att] = 0
         
         # filling in for way_nodes
-
-        i = 0
+        # node ids are kept in an int64 array instead of a dict per <nd>
+        way_nodes = WayNodes(element.attrib['id'])
         for tag in element:
             if tag.tag == 'nd':
-                way_node = {}
-                way_node['id'] = element.attrib['id']
-                way_node['node_id'] = tag.attrib['ref']
-                way_node['position'] = i
-                i += 1
-                way_nodes.append(way_node)
+                way_nodes.append(tag.attrib['ref'])
         
         # filling in for way_tags
             elif tag.tag == 'tag':
-                if tag.attrib['k'] == 'addr:street':
-                    tag.attrib['v'] = update_street(tag.attrib['v'], street_mapping)
-                elif tag.attrib['k'] == 'addr:city':
-                    tag.attrib['v'] = update_city(tag.attrib['v'], city_mapping)
-                elif tag.attrib['k'] == 'phone' or tag.attrib['k'] == 'contact:phone':
-                    tag.attrib['v'] = update_number(tag.attrib['v'])
+                tag.attrib['v'] = clean(tag.attrib['k'], tag.attrib['v'])
                 
                 way_tag = {}
                 if PROBLEMCHARS.match(tag.attrib['k']):
@@ -150,6 +189,45 @@ def shape_element(element, node_attr_fields = NODE_FIELDS, way_attr_fields = WAY
         
         return {'way': way_attribs, 'way_nodes': way_nodes,
                'way_tags': tags}
+
+    elif element.tag == 'relation':
+        relation_attribs = {}
+        for att in RELATION_FIELDS:
+            if att in element.attrib:
+                relation_attribs[att] = element.attrib[att]
+            elif att == 'user':
+                relation_attribs[att] = 'Unknown'
+            elif att == 'uid':
+                relation_attribs[att] = 0
+
+        # members are kept in typed arrays, see node_store.RelationMembers
+        members = RelationMembers(element.attrib['id'])
+        for tag in element:
+            if tag.tag == 'member':
+                members.append(tag.attrib['ref'], tag.attrib['type'],
+                               tag.attrib.get('role', ''))
+            elif tag.tag == 'tag':
+                tag.attrib['v'] = clean(tag.attrib['k'], tag.attrib['v'])
+                relation_tag = shape_tag(element.attrib['id'], tag, problem_chars,
+                                         default_tag_type)
+                if relation_tag:
+                    tags.append(relation_tag)
+
+        return {'relation': relation_attribs, 'relation_members': members,
+                'relation_tags': tags}
+
+
+def shape_tag(element_id, tag, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Return the row of one <tag>, or None if its key has problem chars"""
+    k = tag.attrib['k']
+    if problem_chars.match(k):
+        return None
+    # if k has a colon, separate key and type
+    if LOWER_COLON.match(k):
+        tag_type, key = k.split(':', 1)
+    else:
+        tag_type, key = default_tag_type, k
+    return {'id': element_id, 'key': key, 'value': tag.attrib['v'], 'type': tag_type}
     
     
     
@@ -157,15 +235,25 @@ def shape_element(element, node_attr_fields = NODE_FIELDS, way_attr_fields = WAY
 #               Helper Functions                     #
 # ================================================== #
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend='etree',
+                progress=None, element_filter=None, processes=None,
+                buffer_size=osm_parser.BZ2_BUFFER_SIZE):
+    """Yield element if it is the right type of tag
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    backend is one of osm_parser.BACKENDS; 'expat' and 'lxml' are faster
+    than the default 'etree'.
+    progress, if given, is called with the size of every chunk read.
+    element_filter, an osm_filter.ElementFilter, drops elements outside
+    an area or without the wanted tags.
+    processes and buffer_size are for .bz2 files, see
+    osm_parser.ParallelBZ2Reader.
+    """
+    elements = osm_parser.iter_elements(osm_file, tags=tags, backend=backend,
+                                        progress=progress, processes=processes,
+                                        buffer_size=buffer_size)
+    if element_filter is not None:
+        elements = element_filter(elements)
+    return elements
 
 def validate_element(element, validator, schema=SCHEMA):
     """Raise ValidationError if element does not match schema"""
@@ -179,59 +267,556 @@ def validate_element(element, validator, schema=SCHEMA):
 
 
 class Writer(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+    """Extend csv.DictWriter to handle Unicode input
+
+    utf-8 bytes values are decoded, and str is written as utf-8.
+    writetuples writes rows that are already in field order, so Writer
+    can stand in for sqlite_load.TableWriter or an async_writer.AsyncSink.
+    """
+
+    def _decode(self, row):
+        for v in row.values():
+            if isinstance(v, bytes):
+                return {k: (v.decode('utf-8') if isinstance(v, bytes) else v)
+                        for k, v in row.items()}
+        return row
 
     def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, bytes) else v) for k, v in row.items()
-        })
+        return super(Writer, self).writerow(self._decode(row))
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        self.writer.writerows(self._dict_to_list(self._decode(row)) for row in rows)
+
+    def writetuples(self, rows):
+        """Write rows that are already tuples in field order"""
+        self.writer.writerows(rows)
 
 
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-    with codecs.open(NODES_PATH, 'wb') as nodes_file, \
-        codecs.open(NODE_TAGS_PATH, 'wb') as nodes_tags_file, \
-        codecs.open(WAYS_PATH, 'wb') as ways_file, \
-        codecs.open(WAY_NODES_PATH, 'wb') as way_nodes_file, \
-        codecs.open(WAY_TAGS_PATH, 'wb') as way_tags_file:
-
-        nodes_writer = csv.DictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = csv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = csv.DictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = csv.DictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = csv.DictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element,)
+# bytes buffered per csv file, so rows reach the disk in large writes
+WRITE_BUFFER = 1 << 20
+
+def open_csv(path, mode):
+    return codecs.open(path, mode, buffering=WRITE_BUFFER)
+
+def write_csvs(elements, validate, suffix='', header=True, nodes=None,
+               profiler=None, mode='wb', pipelined=False, budget=None,
+               geometry=False):
+    """Shape each element and write it to the csv(s) named path + suffix
+
+    mode='ab' appends to the csv(s) instead of replacing them.
+    With pipelined each csv is written by a thread of its own, see
+    async_writer.
+    With geometry (which needs nodes) way_geometry.csv is written too.
+    """
+    with open_csv(NODES_PATH + suffix, mode) as nodes_file, \
+        open_csv(NODE_TAGS_PATH + suffix, mode) as nodes_tags_file, \
+        open_csv(WAYS_PATH + suffix, mode) as ways_file, \
+        open_csv(WAY_NODES_PATH + suffix, mode) as way_nodes_file, \
+        open_csv(WAY_TAGS_PATH + suffix, mode) as way_tags_file, \
+        open_csv(RELATIONS_PATH + suffix, mode) as relations_file, \
+        open_csv(RELATION_MEMBERS_PATH + suffix, mode) as relation_members_file, \
+        open_csv(RELATION_TAGS_PATH + suffix, mode) as relation_tags_file:
+
+        nodes_writer = Writer(nodes_file, NODE_FIELDS)
+        node_tags_writer = Writer(nodes_tags_file, NODE_TAGS_FIELDS)
+        ways_writer = Writer(ways_file, WAY_FIELDS)
+        way_nodes_writer = Writer(way_nodes_file, WAY_NODES_FIELDS)
+        way_tags_writer = Writer(way_tags_file, WAY_TAGS_FIELDS)
+        relations_writer = Writer(relations_file, RELATION_FIELDS)
+        relation_members_writer = Writer(relation_members_file, RELATION_MEMBERS_FIELDS)
+        relation_tags_writer = Writer(relation_tags_file, RELATION_TAGS_FIELDS)
+
+        if header:
+            nodes_writer.writeheader()
+            node_tags_writer.writeheader()
+            ways_writer.writeheader()
+            way_nodes_writer.writeheader()
+            way_tags_writer.writeheader()
+            relations_writer.writeheader()
+            relation_members_writer.writeheader()
+            relation_tags_writer.writeheader()
+
+        writers = {'node': nodes_writer,
+                   'node_tags': node_tags_writer,
+                   'way': ways_writer,
+                   'way_nodes': way_nodes_writer,
+                   'way_tags': way_tags_writer,
+                   'relation': relations_writer,
+                   'relation_members': relation_members_writer,
+                   'relation_tags': relation_tags_writer}
+        if not geometry:
+            write_pipelined(elements, writers, validate, nodes, profiler, pipelined,
+                            budget)
+            return
+        with open_csv(WAY_GEOMETRY_PATH + suffix, mode) as way_geometry_file:
+            writers['way_geometry'] = Writer(way_geometry_file, WAY_GEOMETRY_FIELDS)
+            if header:
+                writers['way_geometry'].writeheader()
+            write_pipelined(elements, writers, validate, nodes, profiler, pipelined,
+                            budget)
+
+
+def table_fields(geometry=False):
+    """shape_element key -> column names, for the sqlite and parquet outputs"""
+    fields = {
+        'node': NODE_FIELDS,
+        'node_tags': NODE_TAGS_FIELDS,
+        'way': WAY_FIELDS,
+        'way_nodes': WAY_NODES_FIELDS,
+        'way_tags': WAY_TAGS_FIELDS,
+        'relation': RELATION_FIELDS,
+        'relation_members': RELATION_MEMBERS_FIELDS,
+        'relation_tags': RELATION_TAGS_FIELDS}
+    if geometry:
+        fields['way_geometry'] = WAY_GEOMETRY_FIELDS
+    return fields
+
+
+def write_database(elements, validate, db_path, nodes=None, profiler=None,
+                   budget=None, geometry=False, dictionary=False):
+    """Shape each element and bulk load it into a sqlite database
+
+    With dictionary, users and tag keys, types and values are stored
+    once in lookup tables, see dictionary_encoding.
+    """
+    open_database = sqlite_load.open_database
+    if dictionary:
+        open_database = dictionary_encoding.open_database
+    connection, writers = open_database(db_path, table_fields(geometry))
+    if budget is not None:
+        sqlite_load.limit_memory(connection, budget.limit_mb)
+    write_elements(elements, writers, validate, nodes, profiler, budget)
+    if budget is not None:
+        sqlite_load.shrink_cache(connection, budget.free_mb())
+    # the summary tables are built from the plain tag tables
+    sqlite_load.close_database(connection, writers, summaries=not dictionary)
+
+
+def write_parquet(elements, validate, out_dir, nodes=None, profiler=None,
+                  pipelined=False, budget=None, geometry=False):
+    """Shape each element and write typed parquet files to out_dir"""
+    # imported here, so pyarrow is only loaded for parquet output
+    import parquet_output
+    writers = parquet_output.open_parquet(out_dir, table_fields(geometry))
+    write_pipelined(elements, writers, validate, nodes, profiler, pipelined, budget)
+    parquet_output.close_parquet(writers)
+
+
+def write_pipelined(elements, writers, validate, nodes=None, profiler=None,
+                    pipelined=False, budget=None):
+    """write_elements, with a writer thread per table if pipelined"""
+    if not pipelined:
+        write_elements(elements, writers, validate, nodes, profiler, budget)
+        return
+    sinks = async_writer.start_sinks(writers)
+    try:
+        write_elements(elements, sinks, validate, nodes, profiler, budget)
+    finally:
+        # wait for the threads even after an error, before the files close
+        async_writer.close_sinks(sinks)
+
+
+def write_elements(elements, writers, validate, nodes=None, profiler=None,
+                   budget=None):
+    """Shape each element and send the rows to the writer of each table
+
+    validate=True checks every element with cerberus, validate='fast'
+    checks batches of elements with the compiled schema.
+    The coordinates of every node are added to nodes, a NodeStore, if given.
+    With a profiling.Profiler every stage is timed.
+    With a memory_budget.MemoryBudget, repeated strings are interned and
+    batches shrink whenever the process is over the budget.
+    If writers has a 'way_geometry' table, the geometry of every way is
+    computed from the coordinates in nodes, see way_geometry.
+    """
+    validator = cerberus.Validator()
+    geometry = None
+    if 'way_geometry' in writers:
+        geometry = way_geometry.WayGeometry(nodes, writers['way_geometry'])
+    if validate == 'fast':
+        checkers = fast_validation.compile_schema(SCHEMA)
+    pending = []
+    batch_size = fast_validation.BATCH_SIZE
+
+    shape, clean = shape_element, None
+    check, check_batch = validate_element, fast_validation.validate_batch
+    write = write_shaped
+    if profiler is not None:
+        elements = profiler.wrap_iter(elements)
+        shape = profiler.wrap('shape', shape_element)
+        clean = profiler.wrap('clean', RULES.clean)
+        check = profiler.wrap('validate', validate_element)
+        check_batch = profiler.wrap('validate', fast_validation.validate_batch)
+        write = profiler.wrap('write', write_shaped)
+
+    for element in elements:
+        el = shape(element, clean=clean)
+        if budget is not None:
+            if budget.tick(writers):
+                batch_size = memory_budget.shrink_size(batch_size)
             if el:
-                if validate is True:
-                    validate_element(el, validator)
+                memory_budget.intern_element(el)
+        if el:
+            if validate is True:
+                check(el, validator)
+            elif validate == 'fast':
+                # rows are only written once their batch has passed
+                pending.append(el)
+                if len(pending) >= batch_size:
+                    check_batch(pending, checkers)
+                    write(pending, writers, nodes, geometry)
+                    pending = []
+                continue
+
+            write([el], writers, nodes, geometry)
+
+    if pending:
+        check_batch(pending, checkers)
+        write(pending, writers, nodes, geometry)
+    if geometry is not None:
+        write_geometry = geometry.flush
+        if profiler is not None:
+            write_geometry = profiler.wrap('write', geometry.flush)
+        write_geometry()
+
+
+def write_shaped(shaped, writers, nodes=None, geometry=None):
+    """Send the rows of shaped elements to the writer of each table
+
+    Ways are also handed to geometry, a way_geometry.WayGeometry, if given.
+    """
+    for el in shaped:
+        if 'node' in el:
+            writers['node'].writerow(el['node'])
+            writers['node_tags'].writerows(el['node_tags'])
+            if nodes is not None:
+                node = el['node']
+                nodes.add(node['id'], node['lat'], node['lon'])
+        elif 'way' in el:
+            writers['way'].writerow(el['way'])
+            write_compact_rows(writers['way_nodes'], el['way_nodes'])
+            writers['way_tags'].writerows(el['way_tags'])
+            if geometry is not None:
+                geometry.add(el['way_nodes'].way_id, el['way_nodes'].node_ids)
+        elif 'relation' in el:
+            writers['relation'].writerow(el['relation'])
+            write_compact_rows(writers['relation_members'], el['relation_members'])
+            writers['relation_tags'].writerows(el['relation_tags'])
+
+
+def write_compact_rows(writer, compact):
+    """Write all rows of a WayNodes or RelationMembers in bulk,
+    without a dict per row"""
+    if hasattr(writer, 'writetuples'):
+        # the rows are already in the table's field order
+        writer.writetuples(compact.rows())
+    else:
+        writer.writerows(compact)
+
+
+def process_map(file_in, validate, processes=1, db_path=None, backend='etree',
+                node_store_path=None, profiler=None, parquet_dir=None,
+                element_filter=None, checkpoint_path=None, resume=False,
+                pipelined=False, memory_limit_mb=None, geometry=False,
+                dictionary=False):
+    """Iteratively process each XML element and write to csv(s)
+
+    With processes > 1 the file is split into shards that are converted
+    by a process pool and merged back in file order. A .osm.bz2 file
+    can't be split, so its streams are decompressed by that many
+    processes instead (by default one per cpu).
+    file_in may be an .osm, .osm.bz2 or .osm.gz file.
+    With db_path the rows are loaded straight into that sqlite database
+    instead of the csv(s), and with parquet_dir they are written there as
+    parquet files (needs pyarrow).
+    backend picks the xml parser, see osm_parser.BACKENDS.
+    element_filter, an osm_filter.ElementFilter, keeps only part of the
+    file; an area filter needs processes=1.
+    With node_store_path the coordinates of every node are also saved
+    there as a NodeStore, for resolving way geometry without a join.
+    With a profiling.Profiler the run is timed stage by stage, with
+    progress lines, and its report is written at the end. Parallel runs
+    are only timed as a whole.
+    With checkpoint_path the csv(s) are written segment by segment with a
+    checkpoint after each one; resume=True carries on from the last
+    checkpoint of an interrupted run, see process_map_resumable.
+    With pipelined the csv or parquet files are written by a thread per
+    table, fed through bounded queues, while the main thread parses.
+    With memory_limit_mb, batches and buffers shrink to keep the resident
+    size under that many MB, and a .bz2 file is read ahead into part of
+    it, see memory_budget (serial runs only).
+    With geometry the length, bounding box and centroid of every way are
+    written to a way_geometry table too, see way_geometry (serial runs
+    without checkpoints only).
+    With dictionary (and db_path) the database stores users and tag
+    keys, types and values as ids into lookup tables, see
+    dictionary_encoding.
+    """
+    if geometry and (processes > 1 or checkpoint_path is not None):
+        # a shard or segment doesn't have the coordinates of earlier nodes
+        raise ValueError('way geometry needs processes=1 and no checkpoint')
+    nodes = None
+    if node_store_path is not None or geometry:
+        nodes = NodeStore()
+    budget = None
+    buffer_size = osm_parser.BZ2_BUFFER_SIZE
+    if memory_limit_mb is not None:
+        budget = memory_budget.MemoryBudget(memory_limit_mb)
+        buffer_size = budget.bz2_buffer_size()
+    # processes decompress a .bz2 file, which can't be sharded
+    bz2_processes = processes if processes > 1 else None
+    progress = None
+    if profiler is not None:
+        profiler.start(file_in)
+        progress = profiler.add_bytes
+    if checkpoint_path is not None:
+        if db_path is not None or parquet_dir is not None or processes > 1 \
+                or node_store_path is not None:
+            raise ValueError('checkpoints are only supported for serial csv output')
+        process_map_resumable(file_in, validate, backend, checkpoint_path, resume,
+                              element_filter, profiler, budget)
+    elif db_path is not None:
+        elements = get_element(file_in, backend=backend, progress=progress,
+                               element_filter=element_filter, processes=bz2_processes,
+                               buffer_size=buffer_size)
+        write_database(elements, validate, db_path, nodes, profiler, budget, geometry,
+                       dictionary)
+    elif parquet_dir is not None:
+        elements = get_element(file_in, backend=backend, progress=progress,
+                               element_filter=element_filter, processes=bz2_processes,
+                               buffer_size=buffer_size)
+        write_parquet(elements, validate, parquet_dir, nodes, profiler, pipelined,
+                      budget, geometry)
+    elif processes > 1 and not file_in.endswith('.bz2'):
+        convert = process_map_parallel
+        if profiler is not None:
+            convert = profiler.wrap('parallel', process_map_parallel)
+        convert(file_in, validate, processes, backend, node_store_path, element_filter)
+        # the shards save and merge their own node stores
+        nodes = None
+    else:
+        elements = get_element(file_in, backend=backend, progress=progress,
+                               element_filter=element_filter, processes=bz2_processes,
+                               buffer_size=buffer_size)
+        write_csvs(elements, validate, nodes=nodes, profiler=profiler,
+                   pipelined=pipelined, budget=budget, geometry=geometry)
+    if nodes is not None and node_store_path is not None:
+        nodes.save(node_store_path)
+    if profiler is not None:
+        return profiler.finish()
+
+
+# ================================================== #
+#               Parallel Conversion                  #
+# ================================================== #
+
+CSV_PATHS = [NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+             RELATIONS_PATH, RELATION_MEMBERS_PATH, RELATION_TAGS_PATH]
+
+# start of a top-level element; '<' is always escaped inside attribute
+# values, so every match is a real tag
+ELEMENT_START = re.compile(br'<(node|way|relation)[\s/>]')
+SCAN_SIZE = 1 << 20
+
+def find_element_start(osm_file, offset):
+    """Return the byte offset of the first top-level element at or after offset"""
+    osm_file.seek(offset)
+    overlap = b''
+    while True:
+        chunk = osm_file.read(SCAN_SIZE)
+        if not chunk:
+            return None
+        window = overlap + chunk
+        m = ELEMENT_START.search(window)
+        if m:
+            return offset - len(overlap) + m.start()
+        # keep the tail in case a tag is split between two reads
+        overlap = window[-16:]
+        offset += len(chunk)
+
+def find_shards(file_in, shards):
+    """Split the osm file into byte ranges starting on element boundaries"""
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(0, 2)
+        size = osm_file.tell()
+
+        # everything up to the first element is the <osm> header,
+        # everything after the last one is the closing </osm>
+        first = find_element_start(osm_file, 0)
+        if first is None:
+            return []
+        osm_file.seek(max(first, size - SCAN_SIZE))
+        tail = osm_file.tell()
+        last = tail + osm_file.read().rfind(b'</osm>')
+
+        bounds = [first]
+        for i in range(1, shards):
+            start = find_element_start(osm_file, first + (last - first) * i // shards)
+            if start is not None and bounds[-1] < start < last:
+                bounds.append(start)
+        bounds.append(last)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def process_shard(args):
+    """Convert one shard to headerless part csv(s) and return the suffix"""
+    file_in, start, end, validate, index, backend, node_store_path, element_filter = args
+    suffix = '.part{}'.format(index)
+    elements = osm_parser.iter_elements(file_in, backend=backend, start=start, end=end)
+    if element_filter is not None:
+        elements = element_filter(elements)
+    nodes = NodeStore() if node_store_path is not None else None
+    write_csvs(elements, validate, suffix=suffix, header=False, nodes=nodes)
+    if nodes is not None:
+        nodes.save(node_store_path + suffix)
+    return suffix
+
+def process_map_parallel(file_in, validate, processes, backend='etree',
+                         node_store_path=None, element_filter=None):
+    """Convert shards in a process pool, then merge the parts in file order"""
+    if osm_parser.is_compressed(file_in):
+        raise ValueError('sharding needs an uncompressed .osm file, '
+                         'use processes=1 for {}'.format(file_in))
+    # a shard can't know which nodes of the other shards are inside the area
+    if element_filter is not None and element_filter.area is not None:
+        raise ValueError('an area filter needs processes=1')
+    # more shards than processes so a slow shard doesn't hold up the pool
+    shards = find_shards(file_in, processes * 4)
+    jobs = [(file_in, start, end, validate, i, backend, node_store_path,
+             element_filter)
+            for i, (start, end) in enumerate(shards)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        suffixes = pool.map(process_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    # an empty generator writes just the headers
+    write_csvs(iter(()), validate)
+    for path in CSV_PATHS:
+        with open(path, 'ab') as out_file:
+            for suffix in suffixes:
+                with open(path + suffix, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, out_file)
+                os.remove(path + suffix)
+    if node_store_path is not None:
+        merge_stores([node_store_path + suffix for suffix in suffixes], node_store_path)
+
+
+
+# ================================================== #
+#               Resumable Conversion                 #
+# ================================================== #
+
+CHECKPOINT_PATH = 'convert.checkpoint'
+
+# input bytes converted between two checkpoints
+SEGMENT_SIZE = 64 << 20
+
+def find_segments(file_in, start, segment_size=SEGMENT_SIZE):
+    """Split file_in[start:] into ranges of about segment_size whole elements"""
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(0, 2)
+        size = osm_file.tell()
+        osm_file.seek(max(start, size - SCAN_SIZE))
+        tail = osm_file.tell()
+        last = tail + osm_file.read().rfind(b'</osm>')
+        bounds = [start]
+        while True:
+            next_start = find_element_start(osm_file, bounds[-1] + segment_size)
+            if next_start is None or next_start >= last:
+                break
+            bounds.append(next_start)
+        bounds.append(last)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if a < b]
+
+def save_checkpoint(checkpoint_path, state):
+    # write then rename, so a crash never leaves half a checkpoint
+    with open(checkpoint_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+def input_identity(file_in):
+    """The path, size and mtime a checkpoint records of its input file"""
+    stat = os.stat(file_in)
+    return {'input': os.path.abspath(file_in), 'input_size': stat.st_size,
+            'input_mtime': stat.st_mtime_ns}
+
+def count_elements(elements, counts):
+    for element in elements:
+        counts[element.tag] = counts.get(element.tag, 0) + 1
+        yield element
+
+def process_map_resumable(file_in, validate, backend='etree',
+                          checkpoint_path=CHECKPOINT_PATH, resume=False,
+                          element_filter=None, profiler=None, budget=None):
+    """Convert to csv(s) segment by segment, checkpointing after each one
+
+    A checkpoint records the input offset reached, the element counts so
+    far and the size of every csv at that point. With resume, the csv(s)
+    are cut back to those sizes (dropping rows of a segment that didn't
+    finish) and conversion carries on from that offset, so the output is
+    the same as an uninterrupted run. A checkpoint left by another input
+    file, or by this one before it was changed, is ignored and the
+    conversion starts over. The checkpoint is removed once the whole
+    file is done.
+    """
+    if osm_parser.is_compressed(file_in):
+        raise ValueError('checkpoints need an uncompressed .osm file')
+    # nodes inside the area aren't saved in the checkpoint
+    if element_filter is not None and element_filter.area is not None:
+        raise ValueError('an area filter can not be used with checkpoints')
+    identity = input_identity(file_in)
+
+    state = None
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        # the checkpoint of another file, or of this one before it
+        # changed, can't be carried on from
+        if any(state.get(key) != value for key, value in identity.items()):
+            state = None
+    if state is not None:
+        for path, output_size in state['outputs'].items():
+            with open(path, 'r+b') as f:
+                f.truncate(output_size)
+    else:
+        with open(file_in, 'rb') as osm_file:
+            first = find_element_start(osm_file, 0)
+        # an empty generator writes just the headers
+        write_csvs(iter(()), validate)
+        state = dict(identity, elements={},
+                     offset=identity['input_size'] if first is None else first,
+                     outputs={path: os.path.getsize(path) for path in CSV_PATHS})
+        save_checkpoint(checkpoint_path, state)
 
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+    progress = profiler.add_bytes if profiler is not None else None
+    for start, end in find_segments(file_in, state['offset'], SEGMENT_SIZE):
+        elements = osm_parser.iter_elements(file_in, backend=backend, start=start,
+                                            end=end, progress=progress)
+        if element_filter is not None:
+            elements = element_filter(elements)
+        elements = count_elements(elements, state['elements'])
+        write_csvs(elements, validate, header=False, profiler=profiler, mode='ab',
+                   budget=budget)
+        state['offset'] = end
+        state['outputs'] = {path: os.path.getsize(path) for path in CSV_PATHS}
+        save_checkpoint(checkpoint_path, state)
+    os.remove(checkpoint_path)
+    return state['elements']
 
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(OSM_PATH, validate=True)
+    # Note: Validation with cerberus (validate=True) is ~ 10X slower.
+    # validate='fast' checks the same schema with compiled checkers and is
+    # cheap enough to leave on for the full map.
+    # Use processes to convert on several cores, e.g. processes=8
+    # --resume carries on from the checkpoint of an interrupted run
+    resume = '--resume' in sys.argv[1:]
+    process_map(OSM_PATH, validate='fast', checkpoint_path=CHECKPOINT_PATH,
+                resume=resume)
+    pprint.pprint(cache_report(RULES.cleaners))
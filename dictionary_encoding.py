@@ -0,0 +1,246 @@
+'''
+a smaller sqlite layout: repeated strings stored once, rows hold ids.
+
+node_tags and way_tags repeat the same keys, types and values ('source',
+'regular', 'Bing') millions of times, and nodes and ways the same users.
+with dictionary encoding, those strings go to lookup tables while the
+file streams, each getting an integer id the first time it is seen:
+
+- tag_keys(id, key) and tag_types(id, type), for every tag table
+- users(id, user), for nodes, ways and relations
+- tag_values(id, value), for values seen more than once
+
+tag rows hold key_id, type_id and either value_id or, for a value seen
+only once so far, the value itself. the *_text views join the strings
+back, e.g. SELECT key, value FROM node_tags_text.
+
+counting by key or type (GROUP BY key_id) then only reads integers, and
+the lookup tables are small enough to join afterwards.
+
+osm_queries summaries and osc_update expect the plain layout, so an
+encoded database is queried directly or through the views.
+'''
+
+import sqlite_load
+
+# values are given an id once they are seen this many times
+VALUE_MIN_COUNT = 2
+
+# distinct values waiting for their second sighting; forgotten when full
+MAX_CANDIDATES = 1 << 20
+
+# at most this many values get an id, the rest are stored inline
+MAX_VALUES = 1 << 20
+
+TABLES_SQL = '''
+CREATE TABLE tag_keys (
+    id INTEGER PRIMARY KEY NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE TABLE tag_types (
+    id INTEGER PRIMARY KEY NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE TABLE tag_values (
+    id INTEGER PRIMARY KEY NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT
+);
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user_id INTEGER,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+CREATE TABLE ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user_id INTEGER,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user_id INTEGER,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+CREATE TABLE way_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (node_id) REFERENCES nodes(id)
+);
+CREATE TABLE relation_members (
+    id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    role TEXT,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+''' + ''.join('''
+CREATE TABLE {table} (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    type_id INTEGER,
+    FOREIGN KEY (id) REFERENCES {parent}(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id),
+    FOREIGN KEY (type_id) REFERENCES tag_types(id)
+);
+CREATE VIEW {table}_text AS
+    SELECT t.id, tag_keys.key, COALESCE(tag_values.value, t.value) AS value,
+           tag_types.type
+    FROM {table} t JOIN tag_keys ON tag_keys.id = t.key_id
+    LEFT JOIN tag_values ON tag_values.id = t.value_id
+    LEFT JOIN tag_types ON tag_types.id = t.type_id;
+'''.format(table=table, parent=parent)
+          for table, parent in [('node_tags', 'nodes'), ('way_tags', 'ways'),
+                                ('relation_tags', 'relations')]) + ''.join('''
+CREATE VIEW {table}_text AS
+    SELECT users.user, t.*
+    FROM {table} t LEFT JOIN users ON users.id = t.user_id;
+'''.format(table=table) for table in ['nodes', 'ways', 'relations'])
+
+# lookup table -> its string column
+LOOKUP_TABLES = {'tag_keys': 'key', 'tag_types': 'type', 'users': 'user',
+                 'tag_values': 'value'}
+
+TABLE_NAMES = dict(sqlite_load.TABLE_NAMES,
+                   **{table: table for table in LOOKUP_TABLES})
+
+
+class Dictionary(object):
+    """string -> integer id, numbered from 1 in order of first use
+
+    Every new entry is sent to writer as an (id, string) row. With
+    min_count > 1 a string only gets an id once it has been seen that
+    many times, and encode returns None for it until then.
+    """
+
+    def __init__(self, writer, min_count=1, max_size=None):
+        self.writer = writer
+        self.min_count = min_count
+        self.max_size = max_size
+        self.ids = {}
+        # string -> times seen, for strings without an id yet
+        self.seen = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, s):
+        try:
+            return self.ids[s]
+        except KeyError:
+            pass
+        if s is None:
+            return None
+        if self.min_count > 1:
+            count = self.seen.get(s, 0) + 1
+            if count < self.min_count:
+                if len(self.seen) >= MAX_CANDIDATES:
+                    self.seen.clear()
+                self.seen[s] = count
+                return None
+            del self.seen[s]
+        if self.max_size is not None and len(self.ids) >= self.max_size:
+            return None
+        self.ids[s] = i = len(self.ids) + 1
+        self.writer.writetuples([(i, s)])
+        return i
+
+
+class EncodedWriter(object):
+    """Writes dict rows with their strings replaced by dictionary ids
+
+    fields are the columns of the encoded table. A column named in
+    encoded, e.g. 'key_id', holds the id of the row's 'key' from that
+    Dictionary; the 'value' column is only filled when the value got no
+    id. Other columns are copied from the row.
+    """
+
+    def __init__(self, writer, fields, encoded):
+        self.writer = writer
+        self.fields = fields
+        self.encoded = encoded
+        # (column of the row, Dictionary or None), in the table's field order
+        self.columns = [(f[:-3], encoded[f]) if f in encoded else (f, None)
+                        for f in fields]
+
+    def encode(self, row):
+        values = []
+        for field, dictionary in self.columns:
+            if dictionary is not None:
+                values.append(dictionary.encode(row.get(field)))
+            elif field == 'value':
+                # values[-1] is value_id; the value is only kept without one
+                values.append(row.get('value') if values[-1] is None else None)
+            else:
+                values.append(row.get(field))
+        return tuple(values)
+
+    def writerow(self, row):
+        self.writer.writetuples([self.encode(row)])
+
+    def writerows(self, rows):
+        self.writer.writetuples([self.encode(row) for row in rows])
+
+    def flush(self):
+        self.writer.flush()
+
+
+def encoded_fields(fields):
+    """The columns of each table once users, keys, values and types are ids"""
+    encoded = {}
+    for key, names in fields.items():
+        if key.endswith('_tags'):
+            encoded[key] = ['id', 'key_id', 'value_id', 'value', 'type_id']
+        elif key in ('node', 'way', 'relation'):
+            encoded[key] = ['user_id' if f == 'user' else f for f in names]
+        else:
+            encoded[key] = names
+    return encoded
+
+
+def open_database(db_path, fields):
+    """Create an encoded database and return (connection, writers)
+
+    Takes the same fields as sqlite_load.open_database, and returns
+    writers that can be used the same way.
+    """
+    table_fields = encoded_fields(fields)
+    for table, column in LOOKUP_TABLES.items():
+        table_fields[table] = ['id', column]
+    # sqlite_load adds the way_geometry table when fields has it
+    connection, writers = sqlite_load.open_database(db_path, table_fields, TABLES_SQL,
+                                                    TABLE_NAMES)
+    dictionaries = {
+        'key_id': Dictionary(writers['tag_keys']),
+        'type_id': Dictionary(writers['tag_types']),
+        'user_id': Dictionary(writers['users']),
+        'value_id': Dictionary(writers['tag_values'], VALUE_MIN_COUNT, MAX_VALUES)
+    }
+    for key in fields:
+        names = table_fields[key]
+        encoded = {f: dictionaries[f] for f in names if f in dictionaries}
+        if encoded:
+            writers[key] = EncodedWriter(writers[key], names, encoded)
+    return connection, writers
@@ -0,0 +1,179 @@
+'''
+compile the cerberus schema once into plain python checker functions,
+so every element can be validated without cerberus' per-call overhead.
+
+only the rules used by schema.schema (and a few simple ones) are
+supported; the errors have the same layout and messages as
+cerberus.Validator().errors, so reports look the same either way.
+'''
+
+from collections.abc import Mapping, Sequence
+import pprint
+import re
+
+# cerberus error codes, used to order messages the way cerberus does
+NOT_NULLABLE = 0x23
+BAD_TYPE = 0x24
+REGEX_MISMATCH = 0x41
+MIN_VALUE = 0x42
+MAX_VALUE = 0x43
+UNALLOWED_VALUE = 0x44
+COERCION_FAILED = 0x61
+
+TYPE_CHECKS = {
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'float': lambda v: isinstance(v, (float, int)) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (float, int)) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'dict': lambda v: isinstance(v, Mapping),
+    'list': lambda v: isinstance(v, Sequence) and not isinstance(v, str)
+}
+
+SUPPORTED_RULES = set(['type', 'required', 'coerce', 'nullable', 'allowed',
+                       'regex', 'min', 'max', 'schema'])
+
+# shaped elements are validated this many at a time
+BATCH_SIZE = 1000
+
+
+def compile_field(rules):
+    """Return a checker(name, value) giving the cerberus messages for one field"""
+    unknown = set(rules) - SUPPORTED_RULES
+    if unknown:
+        raise ValueError('rules not supported by fast validation: {}'.format(
+            ', '.join(sorted(unknown))))
+
+    coerce = rules.get('coerce')
+    nullable = rules.get('nullable', False)
+    types = rules.get('type')
+    if isinstance(types, str):
+        types = [types]
+    type_checks = [TYPE_CHECKS[t] for t in types] if types else []
+    type_message = 'must be of {} type'.format(rules.get('type'))
+    allowed = rules.get('allowed')
+    regex = rules.get('regex')
+    if regex is not None:
+        regex_message = "value does not match regex '{}'".format(regex)
+        regex = re.compile(regex if regex.endswith('$') else regex + '$')
+    min_value = rules.get('min')
+    max_value = rules.get('max')
+
+    # nested schema: a dict is checked field by field,
+    # a list has every item checked against the item rules
+    nested = None
+    if 'schema' in rules:
+        if types == ['list']:
+            nested = compile_items(rules['schema'])
+        else:
+            nested = compile_mapping(rules['schema'])
+
+    def check(name, value):
+        messages = []
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception as e:
+                messages.append((COERCION_FAILED,
+                                 "field '{}' cannot be coerced: {}".format(name, e)))
+
+        if value is None:
+            if not nullable:
+                messages.append((NOT_NULLABLE, 'null value not allowed'))
+        elif type_checks and not any(t(value) for t in type_checks):
+            messages.append((BAD_TYPE, type_message))
+        else:
+            if allowed is not None and value not in allowed:
+                messages.append((UNALLOWED_VALUE, 'unallowed value {}'.format(value)))
+            if regex is not None and isinstance(value, str) and not regex.match(value):
+                messages.append((REGEX_MISMATCH, regex_message))
+            if min_value is not None and value < min_value:
+                messages.append((MIN_VALUE, 'min value is {}'.format(min_value)))
+            if max_value is not None and value > max_value:
+                messages.append((MAX_VALUE, 'max value is {}'.format(max_value)))
+            if nested is not None:
+                errors = nested(value)
+                if errors:
+                    messages.append((None, errors))
+
+        if not messages:
+            return None
+        # nested errors always come last, after the field's own messages
+        messages.sort(key=lambda m: 0x100 if m[0] is None else m[0])
+        return [m for code, m in messages]
+
+    check.required = rules.get('required', False)
+    return check
+
+
+def compile_mapping(schema):
+    """Return a checker(document) giving the cerberus errors of a dict"""
+    fields = {name: compile_field(rules) for name, rules in schema.items()}
+    required = [name for name, field in fields.items() if field.required]
+
+    def check(document):
+        errors = {}
+        for name, value in document.items():
+            field = fields.get(name)
+            if field is None:
+                errors[name] = ['unknown field']
+                continue
+            messages = field(name, value)
+            if messages:
+                errors[name] = messages
+        for name in required:
+            if name not in document:
+                errors[name] = ['required field']
+        # cerberus reports fields in sorted order
+        return dict(sorted(errors.items()))
+
+    return check
+
+
+def compile_items(rules):
+    """Return a checker(rows) giving the cerberus errors of every list item"""
+    item = compile_field(rules)
+
+    def check(rows):
+        errors = {}
+        for i, row in enumerate(rows):
+            messages = item(i, row)
+            if messages:
+                errors[i] = messages
+        return dict(sorted(errors.items()))
+
+    return check
+
+
+def compile_schema(schema):
+    """Compile each table of the schema into its own checker function"""
+    return {table: compile_field(rules) for table, rules in schema.items()}
+
+
+def element_errors(element, checkers):
+    """Return the cerberus style errors of one shaped element"""
+    errors = {}
+    for table, value in element.items():
+        check = checkers.get(table)
+        if check is None:
+            errors[table] = ['unknown field']
+            continue
+        messages = check(table, value)
+        if messages:
+            errors[table] = messages
+    for table, check in checkers.items():
+        if check.required and table not in element:
+            errors[table] = ['required field']
+    # cerberus reports fields in sorted order
+    return dict(sorted(errors.items()))
+
+
+def validate_batch(elements, checkers):
+    """Raise the same error as validate_element for the first bad element"""
+    for element in elements:
+        errors = element_errors(element, checkers)
+        if errors:
+            message_string = "\nElement has the following errors:\n{}"
+            error_string = pprint.pformat(errors.items())
+
+            raise Exception(message_string.format(error_string))
@@ -0,0 +1,111 @@
+'''
+profile the tag keys of an osm file in a single pass.
+
+one KeyProfile holds everything count_tags and tag_pattern report:
+how often each element tag and each tag key occurs, which pattern
+(lower, lower_colon, problemchars, other) each key falls into, and
+optionally a few example values per key.
+'''
+
+import random
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+import parse_cache
+from osm_parser import open_osm
+
+# list of patterns to search for
+LOWER = re.compile(r'^([a-z]|_)*$', re.IGNORECASE)
+LOWER_COLON = re.compile(r'^([a-z]|_)*:([a-z]|_)*$', re.IGNORECASE)
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]', re.IGNORECASE)
+
+PATTERNS = ('lower', 'lower_colon', 'problemchars', 'other')
+
+
+def classify_key(k):
+    """Return the first pattern a key matches"""
+    if LOWER.search(k):
+        return 'lower'
+    elif LOWER_COLON.search(k):
+        return 'lower_colon'
+    elif PROBLEMCHARS.search(k):
+        return 'problemchars'
+    return 'other'
+
+
+class KeyProfile(object):
+    """Counts of element tags, tag keys and key patterns, built incrementally
+
+    Each distinct key is classified once. With sample_size > 0 up to that
+    many values of every key are kept, as a uniform reservoir sample.
+    """
+
+    def __init__(self, sample_size=0, seed=0):
+        self.element_counts = Counter()
+        self.key_counts = Counter()
+        self.pattern_counts = dict.fromkeys(PATTERNS, 0)
+        # key -> pattern, for every key seen so far
+        self.patterns = {}
+        self.sample_size = sample_size
+        self.samples = {}
+        self.random = random.Random(seed)
+
+    def add_element(self, tag):
+        self.element_counts[tag] += 1
+
+    def add_tag(self, k, v):
+        self.key_counts[k] += 1
+        pattern = self.patterns.get(k)
+        if pattern is None:
+            pattern = self.patterns[k] = classify_key(k)
+        self.pattern_counts[pattern] += 1
+        if self.sample_size:
+            self.sample(k, v)
+
+    def sample(self, k, v):
+        sample = self.samples.setdefault(k, [])
+        if len(sample) < self.sample_size:
+            sample.append(v)
+        else:
+            # the n-th value replaces a kept one with probability size / n
+            i = self.random.randrange(self.key_counts[k])
+            if i < self.sample_size:
+                sample[i] = v
+
+    def keys_by_pattern(self):
+        """pattern -> distinct keys of that pattern, in order of first appearance"""
+        keys = {pattern: [] for pattern in PATTERNS}
+        for k, pattern in self.patterns.items():
+            keys[pattern].append(k)
+        return keys
+
+
+def profile_keys(filename, sample_size=0, seed=0, cache_dir=None):
+    """Read an osm file once and return its KeyProfile
+
+    With cache_dir the tags are read from a parse_cache there instead.
+    """
+    profile = KeyProfile(sample_size, seed)
+    if cache_dir is not None:
+        tags_path, counts_path = parse_cache.ensure(filename, cache_dir)
+        for _, tags in parse_cache.iter_tags(tags_path):
+            for k, v in tags:
+                profile.add_tag(k, v)
+        profile.element_counts.update(parse_cache.element_counts(counts_path))
+        return profile
+    with open_osm(filename) as osm:
+        context = ET.iterparse(osm, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        for event, element in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            profile.add_element(element.tag)
+            if element.tag == 'tag':
+                profile.add_tag(element.attrib['k'], element.attrib.get('v'))
+            elif depth == 1:
+                root.clear()
+    return profile
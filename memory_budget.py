@@ -0,0 +1,108 @@
+'''
+keep a conversion under a memory budget, for small workers.
+
+the parsers already forget every element once it is handled, so what
+grows is the rows buffered before they are written: the batches of
+sqlite_load.TableWriter, parquet_output.ParquetWriter and
+async_writer.AsyncSink, and the batch waiting for fast validation.
+a MemoryBudget checks the resident size every few thousand elements and,
+when it is over the limit, halves those batch sizes and flushes them.
+repeated strings (users, tag keys and types) are interned so buffered
+rows share them. a .bz2 file is decompressed ahead of the parser into
+a buffer of BZ2_SHARE of the budget.
+'''
+
+import gc
+import os
+import resource
+import sys
+
+# batches are never made smaller than this
+MIN_BATCH_SIZE = 100
+
+# elements between two checks of the resident size
+CHECK_EVERY = 5000
+
+# share of the budget for .bz2 data decompressed ahead of the parser
+BZ2_SHARE = 0.25
+
+# row fields with few distinct values, shared between rows once interned
+INTERNED_FIELDS = ('user', 'key', 'type')
+
+
+def rss_mb():
+    """Current resident set size in MB (the peak where /proc isn't available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def intern_row(row):
+    for field in INTERNED_FIELDS:
+        value = row.get(field)
+        if type(value) is str:
+            row[field] = sys.intern(value)
+
+
+def intern_element(el):
+    """Intern the repeated strings of a shaped element, in place"""
+    for value in el.values():
+        if isinstance(value, dict):
+            intern_row(value)
+        elif isinstance(value, list):
+            for row in value:
+                intern_row(row)
+
+
+class MemoryBudget(object):
+    """An RSS limit in MB, and the batch sizes adapted to stay under it"""
+
+    def __init__(self, limit_mb, check_every=CHECK_EVERY):
+        self.limit_mb = limit_mb
+        self.check_every = check_every
+        self.count = 0
+        self.shrinks = 0
+
+    def bz2_buffer_size(self):
+        """Bytes of decompressed .bz2 data that may be held at once"""
+        return int(self.limit_mb * BZ2_SHARE * (1 << 20))
+
+    def over(self):
+        return rss_mb() > self.limit_mb
+
+    def free_mb(self):
+        """MB left under the limit, or 0 when over it"""
+        return max(0.0, self.limit_mb - rss_mb())
+
+    def tick(self, writers):
+        """Count one element; shrink the writers' batches if over the budget
+
+        Returns True when the batches were shrunk, so the caller can
+        shrink its own buffers too.
+        """
+        self.count += 1
+        if self.count % self.check_every or not self.over():
+            return False
+        self.shrink(writers)
+        return True
+
+    def shrink(self, writers):
+        """Halve the batch size of every writer and write out what it holds"""
+        for writer in writers.values():
+            if hasattr(writer, 'batch_size'):
+                writer.batch_size = shrink_size(writer.batch_size)
+            if hasattr(writer, 'queue'):
+                # fewer batches waiting for an AsyncSink's thread
+                writer.queue.maxsize = max(1, writer.queue.maxsize // 2)
+            if hasattr(writer, 'flush'):
+                writer.flush()
+        gc.collect()
+        self.shrinks += 1
+
+
+def shrink_size(size):
+    return max(MIN_BATCH_SIZE, size // 2)
@@ -0,0 +1,214 @@
+'''
+compact storage for the biggest parts of a conversion:
+the node refs of every way, the members of every relation, and the
+coordinates of every node.
+
+both are kept in typed arrays (int64 ids, float64 lat/lon) rather than
+one dict per row. NumPy is used when it is installed, for bulk lookups
+and for memory-mapping a saved coordinate store.
+'''
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from itertools import repeat
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class WayNodes(Sequence):
+    """The ordered <nd> refs of one way, stored as an int64 array
+
+    Behaves like the old list of {'id', 'node_id', 'position'} dicts, but
+    the dicts are only built when the rows are indexed or iterated (as
+    validation does). Writers use rows() to emit every row in bulk.
+    """
+    __slots__ = ('way_id', 'node_ids')
+
+    def __init__(self, way_id, node_ids=None):
+        self.way_id = way_id
+        self.node_ids = array('q') if node_ids is None else node_ids
+
+    def append(self, node_id):
+        self.node_ids.append(int(node_id))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self.node_ids)
+        return {'id': self.way_id, 'node_id': self.node_ids[i], 'position': i}
+
+    def __iter__(self):
+        for i, node_id in enumerate(self.node_ids):
+            yield {'id': self.way_id, 'node_id': node_id, 'position': i}
+
+    def rows(self):
+        """Return (id, node_id, position) tuples in WAY_NODES_FIELDS order"""
+        return zip(repeat(self.way_id), self.node_ids, range(len(self.node_ids)))
+
+
+class RelationMembers(Sequence):
+    """The ordered <member>s of one relation, stored in typed arrays
+
+    Member ids are int64, member types a one byte code and roles are
+    interned, so a relation with tens of thousands of members stays small.
+    Like WayNodes it acts as a list of row dicts and has rows() for bulk
+    writing.
+    """
+    __slots__ = ('relation_id', 'member_ids', 'type_codes', 'roles')
+
+    TYPES = ('node', 'way', 'relation')
+    TYPE_CODES = {'node': 0, 'way': 1, 'relation': 2}
+
+    def __init__(self, relation_id):
+        self.relation_id = relation_id
+        self.member_ids = array('q')
+        self.type_codes = array('B')
+        self.roles = []
+
+    def append(self, member_id, member_type, role):
+        self.member_ids.append(int(member_id))
+        self.type_codes.append(self.TYPE_CODES[member_type])
+        self.roles.append(sys.intern(role))
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self.member_ids)
+        return {'id': self.relation_id, 'member_id': self.member_ids[i],
+                'type': self.TYPES[self.type_codes[i]], 'role': self.roles[i],
+                'position': i}
+
+    def __iter__(self):
+        for i in range(len(self.member_ids)):
+            yield self[i]
+
+    def rows(self):
+        """Return (id, member_id, type, role, position) tuples"""
+        types = self.TYPES
+        return zip(repeat(self.relation_id), self.member_ids,
+                   (types[code] for code in self.type_codes), self.roles,
+                   range(len(self.member_ids)))
+
+
+class NodeStore(object):
+    """node id -> (lat, lon), kept as three parallel arrays sorted by id"""
+
+    def __init__(self, ids=None, lats=None, lons=None):
+        self.ids = array('q') if ids is None else ids
+        self.lats = array('d') if lats is None else lats
+        self.lons = array('d') if lons is None else lons
+        self.is_sorted = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, node_id, lat, lon):
+        node_id = int(node_id)
+        if self.is_sorted and len(self.ids) and node_id < self.ids[-1]:
+            self.is_sorted = False
+        self.ids.append(node_id)
+        self.lats.append(float(lat))
+        self.lons.append(float(lon))
+
+    def extend(self, other):
+        """Append the nodes of another store, e.g. from the next shard"""
+        if len(other) and len(self.ids) and other.ids[0] < self.ids[-1]:
+            self.is_sorted = False
+        self.ids.extend(other.ids)
+        self.lats.extend(other.lats)
+        self.lons.extend(other.lons)
+        self.is_sorted = self.is_sorted and other.is_sorted
+
+    def finish(self):
+        """Sort by id; osm files are usually sorted already, so this is rare"""
+        if self.is_sorted:
+            return
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        self.ids = array('q', (self.ids[i] for i in order))
+        self.lats = array('d', (self.lats[i] for i in order))
+        self.lons = array('d', (self.lons[i] for i in order))
+        self.is_sorted = True
+
+    def get(self, node_id):
+        """Return (lat, lon) of a node, or None if it isn't in the store"""
+        if np is not None and isinstance(self.ids, np.ndarray):
+            i = int(np.searchsorted(self.ids, node_id))
+        else:
+            i = bisect_left(self.ids, node_id)
+        if i < len(self.ids) and self.ids[i] == node_id:
+            return self.lats[i], self.lons[i]
+        return None
+
+    def coordinates(self, node_ids):
+        """Return (lats, lons) for many nodes at once; missing nodes are nan
+
+        With NumPy these are arrays from a single vectorized search.
+        """
+        if np is None:
+            found = [self.get(node_id) for node_id in node_ids]
+            nan = float('nan')
+            return ([c[0] if c else nan for c in found],
+                    [c[1] if c else nan for c in found])
+        ids = np.asarray(self.ids, dtype=np.int64)
+        wanted = np.asarray(node_ids, dtype=np.int64)
+        lats = np.full(len(wanted), np.nan)
+        lons = np.full(len(wanted), np.nan)
+        if len(ids):
+            i = np.searchsorted(ids, wanted).clip(0, len(ids) - 1)
+            found = ids[i] == wanted
+            lats[found] = np.asarray(self.lats, dtype=np.float64)[i[found]]
+            lons[found] = np.asarray(self.lons, dtype=np.float64)[i[found]]
+        return lats, lons
+
+    def save(self, path):
+        """Write the store as raw arrays: count, ids, lats, lons"""
+        self.finish()
+        with open(path, 'wb') as f:
+            array('q', [len(self.ids)]).tofile(f)
+            array('q', self.ids).tofile(f)
+            array('d', self.lats).tofile(f)
+            array('d', self.lons).tofile(f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Read a saved store; with NumPy and mmap the file is memory-mapped"""
+        with open(path, 'rb') as f:
+            count = array('q')
+            count.fromfile(f, 1)
+            n = count[0]
+            if n == 0:
+                return cls()
+            if np is not None and mmap:
+                offset = count.itemsize
+                ids = np.memmap(path, np.int64, 'r', offset, (n,))
+                lats = np.memmap(path, np.float64, 'r', offset + 8 * n, (n,))
+                lons = np.memmap(path, np.float64, 'r', offset + 16 * n, (n,))
+            else:
+                ids, lats, lons = array('q'), array('d'), array('d')
+                ids.fromfile(f, n)
+                lats.fromfile(f, n)
+                lons.fromfile(f, n)
+        return cls(ids, lats, lons)
+
+
+def merge_stores(paths, path):
+    """Concatenate saved stores (in order) into one file and remove them"""
+    store = NodeStore()
+    for part in paths:
+        store.extend(NodeStore.load(part, mmap=False))
+        os.remove(part)
+    store.save(path)
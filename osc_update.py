@@ -0,0 +1,132 @@
+'''
+apply OsmChange diffs (.osc, .osc.gz, .osc.bz2) to a database built by
+process_map(..., db_path=...), instead of converting the whole extract
+again. every created or modified element goes through the same
+shape_element cleaning as a full conversion, and the osm_queries
+summary tables are updated by their triggers as rows change.
+'''
+
+import sqlite3
+import xml.etree.ElementTree as ET
+
+import cerberus
+import fast_validation
+import sqlite_load
+from csv_convert import (shape_element, validate_element, write_shaped, SCHEMA,
+                         NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS,
+                         WAY_NODES_FIELDS, WAY_TAGS_FIELDS, RELATION_FIELDS,
+                         RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS)
+from osm_parser import open_osm
+
+ACTIONS = ('create', 'modify', 'delete')
+
+# element tag -> the shape_element keys (and tables) it is stored in
+ELEMENT_TABLES = {
+    'node': ['node', 'node_tags'],
+    'way': ['way', 'way_nodes', 'way_tags'],
+    'relation': ['relation', 'relation_members', 'relation_tags']
+}
+
+FIELDS = {
+    'node': NODE_FIELDS,
+    'node_tags': NODE_TAGS_FIELDS,
+    'way': WAY_FIELDS,
+    'way_nodes': WAY_NODES_FIELDS,
+    'way_tags': WAY_TAGS_FIELDS,
+    'relation': RELATION_FIELDS,
+    'relation_members': RELATION_MEMBERS_FIELDS,
+    'relation_tags': RELATION_TAGS_FIELDS
+}
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for every node, way and relation of an osmChange file"""
+    with open_osm(osc_file) as osc:
+        context = ET.iterparse(osc, events=('start', 'end'))
+        _, root = next(context)
+        action = None
+        block = None
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    action = elem.tag
+                    block = elem
+                continue
+            depth -= 1
+            if depth == 2:
+                if action in ACTIONS and elem.tag in ELEMENT_TABLES:
+                    yield action, elem
+                # forget each element once it is applied, so a large
+                # <modify> block doesn't build up in memory
+                block.clear()
+            elif depth == 1:
+                # the whole <create>/<modify>/<delete> block is done
+                root.clear()
+
+
+def current_version(connection, tag, element_id):
+    """Return the version of an element in the database, or None"""
+    table = sqlite_load.TABLE_NAMES[tag]
+    row = connection.execute('SELECT version FROM {} WHERE id = ?'.format(table),
+                             (element_id,)).fetchone()
+    if row is None:
+        return None
+    return int(row[0])
+
+
+def delete_element(connection, tag, element_id):
+    for key in ELEMENT_TABLES[tag]:
+        connection.execute('DELETE FROM {} WHERE id = ?'.format(
+            sqlite_load.TABLE_NAMES[key]), (element_id,))
+
+
+def apply_changes(osc_file, db_path, validate=False):
+    """Apply an osmChange file to the database and return counts per action
+
+    An element is only changed if the diff has a newer version than the
+    database, so replaying a diff (or an older one) changes nothing.
+    validate is the same as for process_map.
+    """
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    writers = {key: sqlite_load.TableWriter(connection, sqlite_load.TABLE_NAMES[key],
+                                            FIELDS[key])
+               for key in FIELDS}
+    validator = cerberus.Validator()
+    if validate == 'fast':
+        checkers = fast_validation.compile_schema(SCHEMA)
+    counts = {'create': 0, 'modify': 0, 'delete': 0, 'skipped': 0}
+
+    connection.execute('BEGIN')
+    try:
+        for action, element in iter_changes(osc_file):
+            element_id = int(element.attrib['id'])
+            version = int(element.attrib.get('version', 0))
+            current = current_version(connection, element.tag, element_id)
+            if current is not None and version <= current:
+                counts['skipped'] += 1
+                continue
+            if action == 'delete' and current is None:
+                counts['skipped'] += 1
+                continue
+
+            delete_element(connection, element.tag, element_id)
+            if action != 'delete':
+                el = shape_element(element)
+                if validate is True:
+                    validate_element(el, validator)
+                elif validate == 'fast':
+                    fast_validation.validate_batch([el], checkers)
+                write_shaped([el], writers)
+                # rows must be in before a later change to the same id
+                for writer in writers.values():
+                    writer.flush()
+            counts[action] += 1
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+    return counts
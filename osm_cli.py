@@ -0,0 +1,148 @@
+'''
+one command line for every step of the wrangling:
+
+    python osm_cli.py count FILE
+    python osm_cli.py patterns FILE
+    python osm_cli.py audit FILE
+    python osm_cli.py clean-report FILE --json report.json --csv values.csv
+    python osm_cli.py convert FILE [--db osm.db | --parquet DIR] ...
+
+count, patterns, audit and clean-report take --cache DIR: the tags of
+FILE are then parsed once and kept in DIR (see parse_cache), and later
+runs on the unchanged file skip the xml.
+
+each subcommand imports only the modules it needs, so starting up doesn't
+load cerberus or pyarrow unless converting.
+'''
+
+import argparse
+import pprint
+import sys
+
+import osm_parser
+
+
+def run_count(args):
+    from count_tags import count_tags
+    print(count_tags(args.file, cache_dir=args.cache))
+
+
+def run_patterns(args):
+    from tag_pattern import print_patterns
+    print_patterns(args.file, cache_dir=args.cache)
+
+
+def run_audit(args):
+    from audit_attributes import print_audits
+    print_audits(args.file, args.backend, args.cache)
+
+
+def run_clean_report(args):
+    from audit_attributes import write_normalization_report
+    from updated_values import load_rules
+    rules = load_rules(args.rules) if args.rules else load_rules()
+    report = write_normalization_report(args.file, args.json, args.csv, rules,
+                                        args.top, args.backend, args.cache)
+    print('{:10} {:>10} {:>10} {:>10} {:>10}'.format('rule', 'values', 'distinct',
+                                                     'changed', 'faulty'))
+    for name, summary in report.items():
+        print('{:10} {:>10} {:>10} {:>10} {:>10}'.format(
+            name, summary['values'], summary['distinct'], summary['changed'],
+            summary['faulty']))
+
+
+VALIDATE = {'fast': 'fast', 'cerberus': True, 'none': False}
+
+
+def run_convert(args):
+    import csv_convert
+    from updated_values import cache_report
+    profiler = None
+    if args.profile:
+        from profiling import Profiler
+        profiler = Profiler(report_path=args.profile)
+    checkpoint_path = csv_convert.CHECKPOINT_PATH if args.checkpoint or args.resume else None
+    csv_convert.process_map(args.file, validate=VALIDATE[args.validate],
+                            processes=args.processes, db_path=args.db,
+                            backend=args.backend, node_store_path=args.node_store,
+                            profiler=profiler, parquet_dir=args.parquet,
+                            checkpoint_path=checkpoint_path, resume=args.resume,
+                            pipelined=args.pipelined, memory_limit_mb=args.memory_limit,
+                            geometry=args.geometry, dictionary=args.dictionary)
+    pprint.pprint(cache_report(csv_convert.RULES.cleaners))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Audit, clean and convert an osm extract')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    # options shared by every subcommand
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('file', help='.osm, .osm.bz2 or .osm.gz file')
+    # count and patterns read the tags with key_profile, which has no choice of parser
+    parsed = argparse.ArgumentParser(add_help=False)
+    parsed.add_argument('--backend', default='etree', choices=sorted(osm_parser.BACKENDS),
+                        help='xml parser (default: etree)')
+    # the cache only holds tags, so it is offered to the tag reports only
+    cached = argparse.ArgumentParser(add_help=False, parents=[common])
+    cached.add_argument('--cache', metavar='DIR',
+                        help='keep the parsed tags in DIR and reuse them')
+
+    count = commands.add_parser('count', parents=[cached], help='count the element tags')
+    count.set_defaults(run=run_count)
+
+    patterns = commands.add_parser('patterns', parents=[cached],
+                                   help='count tag keys by pattern')
+    patterns.set_defaults(run=run_patterns)
+
+    audit = commands.add_parser('audit', parents=[cached, parsed],
+                                help='list faulty streets, postcodes, cities and phones')
+    audit.set_defaults(run=run_audit)
+
+    report = commands.add_parser('clean-report', parents=[cached, parsed],
+                                 help='rank values by count, before and after cleaning')
+    report.add_argument('--json', help='write the report here')
+    report.add_argument('--csv', help='write every counted value here')
+    report.add_argument('--top', type=int, default=20,
+                        help='offenders and changes kept per rule (default: 20)')
+    report.add_argument('--rules', help='cleaning rules config (default: rules_edinburgh.json)')
+    report.set_defaults(run=run_clean_report)
+
+    convert = commands.add_parser('convert', parents=[common, parsed],
+                                  help='convert to csv, sqlite or parquet')
+    convert.add_argument('--db', help='load into this sqlite database')
+    convert.add_argument('--parquet', metavar='DIR', help='write parquet files to DIR')
+    convert.add_argument('--processes', type=int, default=1,
+                         help='shards converted at once, or for .bz2 input, '
+                              'decompression workers (default: 1, or one per cpu for .bz2)')
+    convert.add_argument('--validate', default='fast', choices=sorted(VALIDATE))
+    convert.add_argument('--node-store', help='also save node coordinates here')
+    convert.add_argument('--checkpoint', action='store_true',
+                         help='checkpoint after every segment of the csv output')
+    convert.add_argument('--resume', action='store_true',
+                         help='carry on from the checkpoint of an interrupted run')
+    convert.add_argument('--pipelined', action='store_true',
+                         help='write each table from a thread of its own')
+    convert.add_argument('--memory-limit', type=float, metavar='MB',
+                         help='keep the resident size under MB')
+    convert.add_argument('--geometry', action='store_true',
+                         help='also write the length, bbox and centroid of every way')
+    convert.add_argument('--dictionary', action='store_true',
+                         help='with --db, store users and tag strings in lookup tables')
+    convert.add_argument('--profile', metavar='REPORT',
+                         help='time each stage and write a json report')
+    convert.set_defaults(run=run_convert)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'convert' and args.dictionary and not args.db:
+        parser.error('--dictionary needs --db')
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+'''
+keep only part of an extract while it streams: elements inside a
+bounding box or polygon, and/or elements with certain tags.
+
+filtered out elements are dropped straight after parsing, so they are
+never shaped, validated or written.
+
+osm files list every node before the ways and relations, so the ids of
+the nodes inside the area are known by the time the ways arrive: a way is
+kept if any of its nodes is inside, and a relation if any of its members
+was kept.
+'''
+
+
+class BBox(object):
+    """An area between two latitudes and two longitudes"""
+
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.max_lat = max_lat
+        self.max_lon = max_lon
+
+    def contains(self, lat, lon):
+        return (self.min_lat <= lat <= self.max_lat and
+                self.min_lon <= lon <= self.max_lon)
+
+
+class Polygon(object):
+    """An area given by its outline, a list of (lat, lon) points"""
+
+    def __init__(self, points):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        lats = [lat for lat, lon in self.points]
+        lons = [lon for lat, lon in self.points]
+        # most points outside are rejected by the bounding box alone
+        self.bbox = BBox(min(lats), min(lons), max(lats), max(lons))
+
+    def contains(self, lat, lon):
+        if not self.bbox.contains(lat, lon):
+            return False
+        # even-odd rule: count the edges crossed by a ray going east
+        inside = False
+        points = self.points
+        j = len(points) - 1
+        for i in range(len(points)):
+            lat_i, lon_i = points[i]
+            lat_j, lon_j = points[j]
+            if (lat_i > lat) != (lat_j > lat):
+                crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+                if lon < crossing:
+                    inside = not inside
+            j = i
+        return inside
+
+
+class ElementFilter(object):
+    """Drop the elements outside an area or without the wanted tags
+
+    area is a BBox or Polygon, or None to keep every position.
+    tags maps tag keys to the values to keep, or to None for any value;
+    an element is kept if one of its tags matches. None keeps every
+    element whatever its tags.
+    """
+
+    def __init__(self, area=None, tags=None):
+        self.area = area
+        self.tags = None
+        if tags is not None:
+            self.tags = {k: None if v is None else frozenset(v)
+                         for k, v in tags.items()}
+        self.node_ids = set()
+        self.way_ids = set()
+        self.relation_ids = set()
+
+    def has_tags(self, element):
+        for tag in element.iter('tag'):
+            if tag.attrib['k'] in self.tags:
+                values = self.tags[tag.attrib['k']]
+                if values is None or tag.attrib['v'] in values:
+                    return True
+        return False
+
+    def in_area(self, element):
+        """Check an element against the area, remembering the ids kept"""
+        element_id = int(element.attrib['id'])
+        if element.tag == 'node':
+            inside = self.area.contains(float(element.attrib['lat']),
+                                        float(element.attrib['lon']))
+            if inside:
+                self.node_ids.add(element_id)
+        elif element.tag == 'way':
+            node_ids = self.node_ids
+            inside = any(int(nd.attrib['ref']) in node_ids
+                         for nd in element.iter('nd'))
+            if inside:
+                self.way_ids.add(element_id)
+        elif element.tag == 'relation':
+            kept = {'node': self.node_ids, 'way': self.way_ids,
+                    'relation': self.relation_ids}
+            inside = any(int(member.attrib['ref']) in kept[member.attrib['type']]
+                         for member in element.iter('member'))
+            if inside:
+                self.relation_ids.add(element_id)
+        else:
+            inside = True
+        return inside
+
+    def __call__(self, elements):
+        """Yield the elements that pass the filter"""
+        for element in elements:
+            if self.area is not None and not self.in_area(element):
+                continue
+            if self.tags is not None and not self.has_tags(element):
+                continue
+            yield element
@@ -0,0 +1,361 @@
+'''
+streaming parsers for osm files.
+
+every backend yields the top-level elements (node, way, relation) one at
+a time and forgets them once the next one is read, so memory stays flat.
+
+- 'etree': xml.etree.ElementTree elements, as before
+- 'expat': lightweight Record objects straight from expat callbacks,
+  no tree is built
+- 'lxml': lxml elements, if lxml is installed
+
+.osm.bz2 and .osm.gz files are read through open_osm, decompressing as
+they stream, so no uncompressed copy is written to disk.
+
+Records have the parts of the Element interface the scripts use
+(.tag, .attrib, iterating over children and .iter(tag)), so
+shape_element and the audits work with any backend.
+'''
+
+import bz2
+import collections
+import gzip
+import multiprocessing
+import os
+import re
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+CHUNK_SIZE = 1 << 20
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+
+class Record(object):
+    """A parsed element without a tree: tag, attributes and child records"""
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib, children=None):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = [] if children is None else children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self.children:
+            if tag is None or child.tag == tag:
+                yield child
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+
+# ================================================== #
+#               Compressed Input                     #
+# ================================================== #
+
+# a bz2 stream starts with 'BZh', the block size digit and the block magic
+BZ2_STREAM_START = re.compile(br'BZh[1-9]\x31\x41\x59\x26\x53\x59')
+
+# compressed bytes handed to one worker at a time, at most
+BZ2_JOB_SIZE = 4 << 20
+
+# decompressed bytes a ParallelBZ2Reader holds at once, by default
+BZ2_BUFFER_SIZE = 256 << 20
+
+# decompressed bytes per compressed byte, assumed until a range is measured;
+# osm xml compresses about 12 to 1
+BZ2_RATIO = 16
+
+
+def is_compressed(filename):
+    return filename.endswith('.bz2') or filename.endswith('.gz')
+
+
+def bz2_ranges(filename, job_size=BZ2_JOB_SIZE):
+    """Split a bz2 file into byte ranges of whole streams, about job_size each"""
+    starts = [0]
+    overlap = b''
+    offset = 0
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            window = overlap + chunk
+            base = offset - len(overlap)
+            for m in BZ2_STREAM_START.finditer(window):
+                position = base + m.start()
+                if position - starts[-1] >= job_size:
+                    starts.append(position)
+            overlap = window[-9:]
+            offset += len(chunk)
+    return list(zip(starts, starts[1:] + [offset]))
+
+
+def decompress_range(args):
+    """Decompress filename[start:end]; None if it isn't made of whole streams"""
+    filename, start, end = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    parts = []
+    try:
+        while data:
+            decompressor = bz2.BZ2Decompressor()
+            parts.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                return None
+            data = decompressor.unused_data
+    except (OSError, EOFError):
+        return None
+    return b''.join(parts)
+
+
+class ParallelBZ2Reader(object):
+    """Read-only file object decompressing a bz2 file in a process pool
+
+    Files with several bz2 streams (as written by pbzip2 or lbzip2) are
+    split on stream boundaries and the streams are decompressed in
+    parallel, in order. A file that is a single stream can't be split
+    and is simply read with bz2.
+
+    processes workers (default: one per cpu) decompress ranges ahead of
+    the reader, but only as many as fit in buffer_size decompressed
+    bytes, so a small buffer_size means fewer and smaller jobs.
+    """
+
+    def __init__(self, filename, processes=None, buffer_size=BZ2_BUFFER_SIZE):
+        self.filename = filename
+        self.buffer = b''
+        self.position = 0
+        self.pool = None
+        self.serial = None
+        self.processes = processes or os.cpu_count() or 1
+        self.buffer_size = buffer_size
+        # two ranges per worker should fit in the buffer
+        job_size = max(1, min(BZ2_JOB_SIZE,
+                              buffer_size // (BZ2_RATIO * 2 * self.processes)))
+        ranges = bz2_ranges(filename, job_size)
+        if len(ranges) < 2:
+            self.serial = bz2.open(filename, 'rb')
+            return
+        self.ranges = collections.deque(ranges)
+        self.pending = collections.deque()
+        # the largest decompressed to compressed size seen so far
+        self.ratio = BZ2_RATIO
+        self.pool = multiprocessing.Pool(self.processes)
+
+    def _in_flight(self):
+        """Decompressed bytes of the ranges in flight, as far as can be told"""
+        return sum((end - start) * self.ratio for start, end, job in self.pending)
+
+    def _fill(self):
+        """Return the next decompressed range, or None at the end of the file"""
+        # keep ranges in flight only while their data fits in the buffer,
+        # with the unread part of the last range counted too
+        free = self.buffer_size - (len(self.buffer) - self.position)
+        while self.ranges and len(self.pending) < self.processes * 2:
+            start, end = self.ranges[0]
+            if self.pending and self._in_flight() + (end - start) * self.ratio > free:
+                break
+            self.ranges.popleft()
+            job = self.pool.apply_async(decompress_range, [(self.filename, start, end)])
+            self.pending.append((start, end, job))
+        if not self.pending:
+            return None
+        start, end, job = self.pending.popleft()
+        data = job.get()
+        if data is None:
+            # a false stream start split a stream: put the ranges still in
+            # flight back in order, and retry this one joined with the next
+            self.ranges.extendleft(reversed([(s, e) for s, e, j in self.pending]))
+            self.pending.clear()
+            if not self.ranges:
+                raise OSError('invalid bz2 data in {}'.format(self.filename))
+            next_start, next_end = self.ranges.popleft()
+            self.ranges.appendleft((start, next_end))
+            return self._fill()
+        self.ratio = max(self.ratio, len(data) / float(end - start))
+        return data
+
+    def read(self, size=-1):
+        if self.serial is not None:
+            return self.serial.read(size)
+        while size < 0 or len(self.buffer) - self.position < size:
+            data = self._fill()
+            if data is None:
+                break
+            self.buffer = self.buffer[self.position:] + data
+            self.position = 0
+        if size < 0:
+            size = len(self.buffer) - self.position
+        chunk = self.buffer[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_osm(filename, processes=None, buffer_size=BZ2_BUFFER_SIZE):
+    """Open an .osm, .osm.bz2 or .osm.gz file for reading bytes
+
+    processes and buffer_size are for .bz2 files, see ParallelBZ2Reader.
+    """
+    if filename.endswith('.bz2'):
+        return ParallelBZ2Reader(filename, processes, buffer_size)
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def read_chunks(filename, start=0, end=None, wrap=False, progress=None,
+                processes=None, buffer_size=BZ2_BUFFER_SIZE):
+    """Yield the bytes of filename[start:end] in chunks
+
+    With wrap the range is put inside <osm></osm>, so a slice of
+    top-level elements parses as a document of its own.
+    progress, if given, is called with the size of every chunk.
+    processes and buffer_size are passed to open_osm.
+    """
+    if wrap:
+        yield b'<osm>'
+    with open_osm(filename, processes, buffer_size) as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            if progress is not None:
+                progress(len(chunk))
+            yield chunk
+    if wrap:
+        yield b'</osm>'
+
+
+def parse_etree(chunks, tags):
+    """Yield ElementTree elements, clearing the root after each top-level one"""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if elem.tag in tags:
+                    yield elem
+                root.clear()
+    parser.close()
+
+
+def parse_expat(chunks, tags):
+    """Yield Records built directly from expat callbacks"""
+    ready = []
+    # [depth, record being built]
+    state = [0, None]
+
+    def start(name, attrs):
+        depth = state[0] + 1
+        state[0] = depth
+        if depth == 2:
+            if name in tags:
+                state[1] = Record(name, attrs)
+        elif depth == 3 and state[1] is not None:
+            state[1].children.append(Record(name, attrs))
+
+    def end(name):
+        if state[0] == 2 and state[1] is not None:
+            ready.append(state[1])
+            state[1] = None
+        state[0] -= 1
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        if ready:
+            for record in ready:
+                yield record
+            del ready[:]
+    parser.Parse(b'', True)
+    for record in ready:
+        yield record
+
+
+def parse_lxml(chunks, tags):
+    """Yield lxml elements, letting lxml skip every other tag"""
+    if lxml_etree is None:
+        raise ImportError("the 'lxml' backend needs lxml installed")
+    # every top-level element has to come through here to be deleted,
+    # including those of the tags that aren't wanted
+    parser = lxml_etree.XMLPullParser(events=('end',), tag=TOP_LEVEL_TAGS)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            # skip matching tags nested below a top-level element
+            if elem.getparent() is None or elem.getparent().getparent() is not None:
+                continue
+            if elem.tag in tags:
+                yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    parser.close()
+
+
+BACKENDS = {
+    'etree': parse_etree,
+    'expat': parse_expat,
+    'lxml': parse_lxml
+}
+
+
+def iter_elements(filename, tags=TOP_LEVEL_TAGS, backend='etree',
+                  start=0, end=None, progress=None, processes=None,
+                  buffer_size=BZ2_BUFFER_SIZE):
+    """Yield the top-level elements of filename with one of the BACKENDS
+
+    start/end restrict parsing to a byte range of whole top-level elements,
+    such as a shard from csv_convert.find_shards (uncompressed files only).
+    processes and buffer_size are for .bz2 files, see ParallelBZ2Reader.
+    """
+    # a range past the <osm> header is parsed as a document of its own
+    wrap = start > 0
+    chunks = read_chunks(filename, start, end, wrap, progress, processes, buffer_size)
+    return BACKENDS[backend](chunks, tags)
@@ -0,0 +1,215 @@
+'''
+the reports of the writeup as python functions over the sqlite database.
+
+instead of a UNION ALL + GROUP BY over node_tags and way_tags for every
+report, counts are kept in small summary tables:
+
+- tag_counts: (type, key, value) -> number of node and way tags
+- user_counts: (uid, user) -> number of nodes and ways
+- table_counts: table -> number of rows
+
+they are built once after a load (sqlite_load.close_database calls
+build_summaries) and kept up to date by triggers afterwards, so applying
+a diff with osc_update refreshes them incrementally.
+'''
+
+import sqlite3
+
+SUMMARY_TABLES_SQL = '''
+DROP TABLE IF EXISTS tag_counts;
+DROP TABLE IF EXISTS user_counts;
+DROP TABLE IF EXISTS table_counts;
+CREATE TABLE tag_counts (
+    type TEXT,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    UNIQUE (type, key, value)
+);
+CREATE TABLE user_counts (
+    uid INTEGER,
+    user TEXT,
+    num INTEGER NOT NULL,
+    UNIQUE (uid, user)
+);
+CREATE TABLE table_counts (
+    name TEXT PRIMARY KEY NOT NULL,
+    num INTEGER NOT NULL
+);
+INSERT INTO tag_counts (type, key, value, num)
+    SELECT type, key, value, COUNT(*)
+    FROM (SELECT type, key, value FROM node_tags
+          UNION ALL SELECT type, key, value FROM way_tags)
+    GROUP BY type, key, value;
+INSERT INTO user_counts (uid, user, num)
+    SELECT uid, user, COUNT(*)
+    FROM (SELECT uid, user FROM nodes UNION ALL SELECT uid, user FROM ways)
+    GROUP BY uid, user;
+CREATE INDEX tag_counts_key ON tag_counts(key, value);
+CREATE INDEX user_counts_num ON user_counts(num);
+'''
+
+# tables whose row count is kept in table_counts
+COUNTED_TABLES = ['nodes', 'node_tags', 'ways', 'way_tags', 'way_nodes',
+                  'relations', 'relation_members', 'relation_tags']
+
+# for users_for_key, which joins tags back to their element
+QUERY_INDEXES_SQL = '''
+CREATE INDEX IF NOT EXISTS node_tags_key ON node_tags(key, id);
+CREATE INDEX IF NOT EXISTS way_tags_key ON way_tags(key, id);
+'''
+
+TAG_TRIGGERS_SQL = '''
+DROP TRIGGER IF EXISTS {table}_count_insert;
+DROP TRIGGER IF EXISTS {table}_count_delete;
+CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO tag_counts (type, key, value, num)
+        VALUES (NEW.type, NEW.key, NEW.value, 1)
+        ON CONFLICT (type, key, value) DO UPDATE SET num = num + 1;
+END;
+CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table} BEGIN
+    UPDATE tag_counts SET num = num - 1
+        WHERE type IS OLD.type AND key = OLD.key AND value = OLD.value;
+    DELETE FROM tag_counts
+        WHERE type IS OLD.type AND key = OLD.key AND value = OLD.value AND num <= 0;
+END;
+'''
+
+USER_TRIGGERS_SQL = '''
+DROP TRIGGER IF EXISTS {table}_user_insert;
+DROP TRIGGER IF EXISTS {table}_user_delete;
+CREATE TRIGGER {table}_user_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO user_counts (uid, user, num) VALUES (NEW.uid, NEW.user, 1)
+        ON CONFLICT (uid, user) DO UPDATE SET num = num + 1;
+END;
+CREATE TRIGGER {table}_user_delete AFTER DELETE ON {table} BEGIN
+    UPDATE user_counts SET num = num - 1
+        WHERE uid IS OLD.uid AND user IS OLD.user;
+    DELETE FROM user_counts
+        WHERE uid IS OLD.uid AND user IS OLD.user AND num <= 0;
+END;
+'''
+
+ROW_TRIGGERS_SQL = '''
+DROP TRIGGER IF EXISTS {table}_rows_insert;
+DROP TRIGGER IF EXISTS {table}_rows_delete;
+CREATE TRIGGER {table}_rows_insert AFTER INSERT ON {table} BEGIN
+    UPDATE table_counts SET num = num + 1 WHERE name = '{table}';
+END;
+CREATE TRIGGER {table}_rows_delete AFTER DELETE ON {table} BEGIN
+    UPDATE table_counts SET num = num - 1 WHERE name = '{table}';
+END;
+'''
+
+
+def build_summaries(connection):
+    """(Re)build the summary tables and the triggers that maintain them
+
+    Called after a full load; the triggers then keep the summaries in
+    step with every later insert and delete.
+    """
+    connection.executescript(QUERY_INDEXES_SQL)
+    connection.executescript(SUMMARY_TABLES_SQL)
+    for table in COUNTED_TABLES:
+        connection.execute('INSERT INTO table_counts (name, num) '
+                           'SELECT ?, COUNT(*) FROM {}'.format(table), (table,))
+    script = []
+    for table in ['node_tags', 'way_tags']:
+        script.append(TAG_TRIGGERS_SQL.format(table=table))
+    for table in ['nodes', 'ways']:
+        script.append(USER_TRIGGERS_SQL.format(table=table))
+    for table in COUNTED_TABLES:
+        script.append(ROW_TRIGGERS_SQL.format(table=table))
+    connection.executescript(''.join(script))
+
+
+def connect(db_path):
+    """Open a database, building the summaries if it predates them"""
+    connection = sqlite3.connect(db_path)
+    exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                "AND name = 'tag_counts'").fetchone()
+    if exists is None:
+        build_summaries(connection)
+        connection.commit()
+    return connection
+
+
+# ================================================== #
+#               Reports                              #
+# ================================================== #
+
+def table_counts(connection):
+    """Number of rows in each table"""
+    return dict(connection.execute('SELECT name, num FROM table_counts'))
+
+
+def unique_users(connection):
+    """Number of distinct uids among node and way contributors"""
+    return connection.execute('SELECT COUNT(DISTINCT uid) FROM user_counts').fetchone()[0]
+
+
+def top_users(connection, n=10):
+    """(user, nodes + ways) for the n biggest contributors"""
+    return connection.execute('SELECT user, SUM(num) AS total FROM user_counts '
+                              'GROUP BY user ORDER BY total DESC LIMIT ?',
+                              (n,)).fetchall()
+
+
+def top_types(connection, n=10):
+    """(type, count) of the most common tag types"""
+    return connection.execute('SELECT type, SUM(num) AS total FROM tag_counts '
+                              'GROUP BY type ORDER BY total DESC LIMIT ?',
+                              (n,)).fetchall()
+
+
+def top_keys(connection, n=10, tag_type=None):
+    """(key, count) of the most common tag keys, optionally of one type
+
+    e.g. top_keys(connection, tag_type='regular') or tag_type='abandoned'.
+    """
+    if tag_type is None:
+        return connection.execute('SELECT key, SUM(num) AS total FROM tag_counts '
+                                  'GROUP BY key ORDER BY total DESC LIMIT ?',
+                                  (n,)).fetchall()
+    return connection.execute('SELECT key, SUM(num) AS total FROM tag_counts '
+                              'WHERE type = ? GROUP BY key ORDER BY total DESC LIMIT ?',
+                              (tag_type, n)).fetchall()
+
+
+def top_values(connection, n=10, key=None, tag_type=None):
+    """(value, count) of the most common values of a key and/or tag type
+
+    e.g. top_values(connection, key='amenity') or tag_type='regular'.
+    """
+    where, params = [], []
+    if key is not None:
+        where.append('key = ?')
+        params.append(key)
+    if tag_type is not None:
+        where.append('type = ?')
+        params.append(tag_type)
+    sql = 'SELECT value, SUM(num) AS total FROM tag_counts'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' GROUP BY value ORDER BY total DESC LIMIT ?'
+    return connection.execute(sql, params + [n]).fetchall()
+
+
+def values_for_keys(connection, keys, n=10):
+    """(value, key, count) for several keys, e.g. ['history', 'historic']"""
+    sql = ('SELECT value, key, SUM(num) AS total FROM tag_counts '
+           'WHERE key IN ({}) GROUP BY value, key ORDER BY total DESC LIMIT ?')
+    return connection.execute(sql.format(', '.join('?' * len(keys))),
+                              list(keys) + [n]).fetchall()
+
+
+def users_for_key(connection, key, n=10):
+    """(user, count) of the users whose nodes and ways have a tag key"""
+    return connection.execute('''
+        SELECT user, COUNT(*) AS num FROM (
+            SELECT nodes.user FROM node_tags JOIN nodes ON nodes.id = node_tags.id
+            WHERE node_tags.key = ?
+            UNION ALL
+            SELECT ways.user FROM way_tags JOIN ways ON ways.id = way_tags.id
+            WHERE way_tags.key = ?)
+        GROUP BY user ORDER BY num DESC LIMIT ?''', (key, key, n)).fetchall()
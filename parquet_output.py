@@ -0,0 +1,133 @@
+'''
+write shaped elements as compressed parquet files, one per table,
+instead of the csv files.
+
+rows are buffered and written as arrow record batches with typed columns:
+int64 ids, float64 lat/lon, utc timestamps, and dictionary encoded
+user/key/type/role columns. pyarrow is only needed for this output mode.
+'''
+
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from sqlite_load import TABLE_NAMES
+
+PARQUET_DIR = 'parquet'
+
+# rows per record batch (and parquet row group)
+BATCH_SIZE = 65536
+
+COMPRESSION = 'zstd'
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# column -> kind, for every column of every table; columns not listed are strings
+COLUMN_KINDS = {
+    'id': 'int', 'uid': 'int', 'version': 'int', 'changeset': 'int',
+    'node_id': 'int', 'member_id': 'int', 'position': 'int',
+    'lat': 'float', 'lon': 'float',
+    # way_geometry
+    'length': 'float', 'min_lat': 'float', 'min_lon': 'float',
+    'max_lat': 'float', 'max_lon': 'float', 'missing_nodes': 'int',
+    'timestamp': 'timestamp',
+    # few distinct values, so these are stored as a dictionary plus indices
+    'user': 'dictionary', 'key': 'dictionary', 'type': 'dictionary',
+    'role': 'dictionary'
+}
+
+
+def arrow_type(kind):
+    if kind == 'int':
+        return pa.int64()
+    if kind == 'float':
+        return pa.float64()
+    if kind == 'timestamp':
+        return pa.timestamp('s', tz='UTC')
+    if kind == 'dictionary':
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def to_array(values, kind):
+    """Build a typed arrow array from one column of buffered row values"""
+    if kind == 'int':
+        return pa.array([None if v is None else int(v) for v in values], pa.int64())
+    if kind == 'float':
+        return pa.array([None if v is None else float(v) for v in values], pa.float64())
+    strings = pa.array(values, pa.string())
+    if kind == 'timestamp':
+        parsed = pc.strptime(strings, format=TIMESTAMP_FORMAT, unit='s')
+        return parsed.cast(arrow_type(kind))
+    if kind == 'dictionary':
+        return strings.dictionary_encode()
+    return strings
+
+
+class ParquetWriter(object):
+    """Buffer rows for one table and write them to parquet in record batches
+
+    Has the same writerow/writerows/writetuples interface as
+    sqlite_load.TableWriter, so write_elements can use it as is.
+    """
+
+    def __init__(self, path, fields, batch_size=BATCH_SIZE, compression=COMPRESSION):
+        self.fields = fields
+        self.kinds = [COLUMN_KINDS.get(f, 'string') for f in fields]
+        self.batch_size = batch_size
+        self.rows = []
+        self.schema = pa.schema([(f, arrow_type(kind))
+                                 for f, kind in zip(fields, self.kinds)])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def writerow(self, row):
+        self.rows.append(tuple(row.get(f) for f in self.fields))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writetuples(self, rows):
+        """Add rows that are already tuples in field order"""
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        arrays = [to_array(values, kind) for values, kind in zip(columns, self.kinds)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_parquet(out_dir, fields):
+    """Create out_dir and return a ParquetWriter per table
+
+    fields maps each shape_element key to its column names; the files are
+    named after the sqlite tables, e.g. out_dir/nodes.parquet.
+    """
+    if pa is None:
+        raise ImportError('parquet output needs pyarrow installed')
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    return {key: ParquetWriter(os.path.join(out_dir, TABLE_NAMES[key] + '.parquet'),
+                               fields[key])
+            for key in fields}
+
+
+def close_parquet(writers):
+    for writer in writers.values():
+        writer.close()
@@ -0,0 +1,138 @@
+'''
+an on-disk cache of the tags of an osm file, for the audits.
+
+count_tags, tag_pattern, the audits and the normalization report only
+look at the tags of each element, yet each run parses the whole xml.
+with a cache directory, the first run parses the file once and saves
+
+- <key>.tags: the tags of every top-level element that has any, as
+  pickled batches of (element tag, ((k, v), ...)) tuples
+- <key>.json: how often every element tag occurs in the file
+
+where key is the sha1 of the file's content and its mtime. later runs on
+the unchanged file read those instead of the xml; an edited file gets a
+new key, so a stale cache is never used. the json is written last, so a
+cache without one is incomplete and rebuilt.
+
+elements come back as osm_parser.Record objects with only their tag
+children, which is all the audits use. the conversion needs coordinates,
+refs and attributes, so it always parses the xml.
+'''
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+import osm_parser
+
+CACHE_DIR = '.osm_cache'
+
+# elements per pickled batch
+BATCH_SIZE = 10000
+
+# bumped whenever the layout of the cache files changes
+VERSION = 1
+
+
+def file_key(filename):
+    """sha1 of the content of filename, and its mtime in nanoseconds"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(osm_parser.CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return '{}-{}'.format(sha1.hexdigest(), os.stat(filename).st_mtime_ns)
+
+
+def cache_paths(filename, cache_dir=CACHE_DIR):
+    """(tags path, counts path) of the cache of filename"""
+    base = os.path.join(cache_dir, file_key(filename))
+    return base + '.tags', base + '.json'
+
+
+def build(filename, tags_path, counts_path):
+    """Parse filename once and write its cache files"""
+    counts = Counter()
+    batch = []
+    tmp_path = tags_path + '.tmp'
+    with osm_parser.open_osm(filename) as osm, open(tmp_path, 'wb') as out:
+        context = ET.iterparse(osm, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        for event, element in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            counts[element.tag] += 1
+            if depth != 1:
+                continue
+            if element.tag in osm_parser.TOP_LEVEL_TAGS:
+                tags = tuple((sys.intern(tag.attrib['k']), tag.attrib.get('v'))
+                             for tag in element.iter('tag'))
+                if tags:
+                    batch.append((element.tag, tags))
+                    if len(batch) >= BATCH_SIZE:
+                        pickle.dump(batch, out, pickle.HIGHEST_PROTOCOL)
+                        batch = []
+            root.clear()
+        if batch:
+            pickle.dump(batch, out, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, tags_path)
+    with open(counts_path + '.tmp', 'w') as f:
+        json.dump({'version': VERSION, 'source': os.path.abspath(filename),
+                   'element_counts': list(counts.items())}, f)
+    os.replace(counts_path + '.tmp', counts_path)
+
+
+def ensure(filename, cache_dir=CACHE_DIR):
+    """Return the cache paths of filename, building the cache if needed"""
+    tags_path, counts_path = cache_paths(filename, cache_dir)
+    try:
+        with open(counts_path) as f:
+            valid = json.load(f)['version'] == VERSION
+    except (OSError, ValueError, KeyError):
+        valid = False
+    if not valid or not os.path.exists(tags_path):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        build(filename, tags_path, counts_path)
+    return tags_path, counts_path
+
+
+def iter_tags(tags_path, tags=osm_parser.TOP_LEVEL_TAGS):
+    """Yield (element tag, ((k, v), ...)) for the cached elements of tags"""
+    with open(tags_path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            for record in batch:
+                if record[0] in tags:
+                    yield record
+
+
+def element_counts(counts_path):
+    """element tag -> count for the whole file, in order of first appearance"""
+    with open(counts_path) as f:
+        return dict(json.load(f)['element_counts'])
+
+
+def iter_elements(filename, tags=osm_parser.TOP_LEVEL_TAGS, backend='etree',
+                  cache_dir=None):
+    """Yield the elements of filename with their tags, from the cache if given
+
+    Without cache_dir this is osm_parser.iter_elements. With it, the
+    elements that have tags are read from the cache as Records whose
+    children are their tags.
+    """
+    if cache_dir is None:
+        return osm_parser.iter_elements(filename, tags=tags, backend=backend)
+    tags_path, _ = ensure(filename, cache_dir)
+    return (osm_parser.Record(tag, {}, [osm_parser.Record('tag', {'k': k, 'v': v})
+                                        for k, v in element_tags])
+            for tag, element_tags in iter_tags(tags_path, tags))
@@ -0,0 +1,140 @@
+'''
+per-stage timing for process_map.
+
+a Profiler passed to process_map times xml parsing, shape_element, the
+cleaning rules, validation and writing; counts elements per tag; prints
+progress lines with an ETA from the input byte offset; and writes a json
+report at the end. one stage can also be run under cProfile.
+
+without a Profiler, process_map runs exactly as before, so there is no
+overhead when profiling is off.
+'''
+
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+STAGES = ('parse', 'shape', 'clean', 'validate', 'write')
+
+
+class Profiler(object):
+    """Collects per-stage times and element counts for one conversion
+
+    Stage times are exclusive: time spent cleaning tag values is counted
+    under 'clean', not under the 'shape' stage that calls it.
+    """
+
+    def __init__(self, report_path=None, progress_every=10.0, profile_stage=None,
+                 profile_path='stage.prof', out=sys.stderr):
+        self.report_path = report_path
+        self.progress_every = progress_every
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path
+        self.out = out
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.stack = []
+        self.profile = cProfile.Profile() if profile_stage else None
+        self.total_bytes = None
+        self.bytes_read = 0
+        self.started = None
+        self.mark = None
+        self.next_progress = None
+
+    # ---- stage timers ----
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self.stack:
+            self.times[self.stack[-1]] += now - self.mark
+        self.stack.append(stage)
+        self.mark = now
+        if stage == self.profile_stage:
+            self.profile.enable()
+
+    def exit(self):
+        now = time.perf_counter()
+        stage = self.stack.pop()
+        if stage == self.profile_stage:
+            self.profile.disable()
+        self.times[stage] += now - self.mark
+        self.mark = now
+        if now >= self.next_progress:
+            self.print_progress(now)
+
+    def wrap(self, stage, function):
+        """Return function timed under stage"""
+        def timed(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        return timed
+
+    def wrap_iter(self, elements):
+        """Time the parser and count the elements it yields, per tag"""
+        elements = iter(elements)
+        while True:
+            self.enter('parse')
+            try:
+                element = next(elements)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            self.counts[element.tag] += 1
+            yield element
+
+    def add_bytes(self, n):
+        """Progress hook for osm_parser: n more bytes of input were read"""
+        self.bytes_read += n
+
+    # ---- run ----
+
+    def start(self, file_in=None):
+        self.started = self.mark = time.perf_counter()
+        self.next_progress = self.started + self.progress_every
+        if file_in is not None and not file_in.endswith(('.bz2', '.gz')):
+            self.total_bytes = os.path.getsize(file_in)
+
+    def print_progress(self, now):
+        self.next_progress = now + self.progress_every
+        elapsed = now - self.started
+        elements = sum(self.counts.values())
+        line = '{:.0f}s: {} elements ({:.0f}/sec), {:.1f} MB read'.format(
+            elapsed, elements, elements / elapsed, self.bytes_read / 1e6)
+        if self.total_bytes and self.bytes_read:
+            done = float(self.bytes_read) / self.total_bytes
+            eta = elapsed / done - elapsed
+            line += ', {:.1f}% ETA {:.0f}s'.format(done * 100, eta)
+        self.out.write(line + '\n')
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        # ru_maxrss is in kilobytes on linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        return {
+            'seconds': elapsed,
+            'stages': dict((stage, self.times[stage]) for stage in
+                           list(STAGES) + [s for s in self.times if s not in STAGES]),
+            'elements': dict(self.counts),
+            'elements_per_sec': dict((tag, count / elapsed if elapsed else 0.0)
+                                     for tag, count in self.counts.items()),
+            'bytes_read': self.bytes_read,
+            'peak_rss_mb': peak
+        }
+
+    def finish(self):
+        """Write the json report (and the cProfile stats) and return the report"""
+        report = self.report()
+        if self.report_path is not None:
+            with open(self.report_path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        if self.profile is not None:
+            self.profile.dump_stats(self.profile_path)
+        return report
@@ -0,0 +1,234 @@
+'''
+load shaped elements straight into a sqlite database,
+without writing the csv files first
+'''
+
+import os
+import sqlite3
+
+import osm_queries
+
+DB_PATH = 'edinburgh.db'
+
+# rows are sent to sqlite in batches of this size
+BATCH_SIZE = 50000
+
+TABLES_SQL = '''
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT
+);
+CREATE TABLE node_tags (
+    id INTEGER,
+    key TEXT,
+    value TEXT,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES nodes(id)
+);
+CREATE TABLE ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+);
+CREATE TABLE way_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+CREATE TABLE way_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (node_id) REFERENCES nodes(id)
+);
+CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+);
+CREATE TABLE relation_members (
+    id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    role TEXT,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+CREATE TABLE relation_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+'''
+
+# only created when the conversion computes way geometry, see way_geometry
+WAY_GEOMETRY_SQL = '''
+CREATE TABLE way_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    length REAL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    lat REAL,
+    lon REAL,
+    missing_nodes INTEGER,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+'''
+
+# indexes are built once after the load, which is much cheaper
+# than keeping them up to date on every insert
+INDEXES_SQL = '''
+CREATE INDEX IF NOT EXISTS node_tags_id ON node_tags(id);
+CREATE INDEX IF NOT EXISTS way_tags_id ON way_tags(id);
+CREATE INDEX IF NOT EXISTS way_nodes_id ON way_nodes(id);
+CREATE INDEX IF NOT EXISTS way_nodes_node_id ON way_nodes(node_id);
+CREATE INDEX IF NOT EXISTS relation_members_id ON relation_members(id);
+CREATE INDEX IF NOT EXISTS relation_members_member ON relation_members(type, member_id);
+CREATE INDEX IF NOT EXISTS relation_tags_id ON relation_tags(id);
+'''
+
+# trade durability for speed while loading; a failed load is simply rerun
+LOAD_PRAGMAS = '''
+PRAGMA journal_mode = OFF;
+PRAGMA synchronous = OFF;
+PRAGMA locking_mode = EXCLUSIVE;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -200000;
+'''
+
+# share of a memory budget given to sqlite's page cache; the load only
+# appends rows, so a small cache is enough until the indexes are built
+CACHE_SHARE = 0.1
+
+
+def limit_memory(connection, limit_mb):
+    """Keep sqlite's own memory use within part of a budget of limit_mb MB
+
+    The page cache gets CACHE_SHARE of the budget, and the sorts of the
+    index builds spill to temporary files instead of memory.
+    """
+    cache_kb = int(limit_mb * 1024 * CACHE_SHARE)
+    connection.execute('PRAGMA cache_size = -{}'.format(cache_kb))
+    connection.execute('PRAGMA temp_store = FILE')
+
+
+# page cache the index builds get at least, in KB
+MIN_CACHE_KB = 2048
+
+
+def shrink_cache(connection, free_mb):
+    """Release sqlite's page cache and keep it within free_mb MB from now on
+
+    Called before the index builds of a budgeted load: python keeps the
+    memory the load used, so only the rest of the budget is free.
+    """
+    cache_kb = max(MIN_CACHE_KB, int(free_mb * 1024))
+    connection.execute('PRAGMA cache_size = -{}'.format(cache_kb))
+    connection.execute('PRAGMA shrink_memory')
+
+
+# shape_element key -> table name
+TABLE_NAMES = {
+    'node': 'nodes',
+    'node_tags': 'node_tags',
+    'way': 'ways',
+    'way_tags': 'way_tags',
+    'way_nodes': 'way_nodes',
+    'relation': 'relations',
+    'relation_members': 'relation_members',
+    'relation_tags': 'relation_tags',
+    'way_geometry': 'way_geometry'
+}
+
+
+class TableWriter(object):
+    """Buffer rows for one table and insert them with executemany
+
+    Has the same writerow/writerows interface as csv.DictWriter so it
+    can be used wherever process_map uses a csv writer.
+    """
+
+    def __init__(self, connection, table, fields, batch_size=BATCH_SIZE):
+        self.connection = connection
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = []
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ', '.join('"{}"'.format(f) for f in fields),
+            ', '.join('?' * len(fields)))
+
+    def writerow(self, row):
+        self.rows.append(tuple(row.get(f) for f in self.fields))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writetuples(self, rows):
+        """Add rows that are already tuples in field order"""
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.connection.executemany(self.sql, self.rows)
+            self.rows = []
+
+
+def open_database(db_path, fields, tables_sql=TABLES_SQL, table_names=TABLE_NAMES):
+    """Create the tables in a fresh database and return (connection, writers)
+
+    fields maps each shape_element key to its column names, and
+    table_names each key to its table.
+    """
+    # like the csv files, an existing database is replaced
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    # isolation_level=None so the whole load runs in one explicit transaction
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    connection.executescript(LOAD_PRAGMAS)
+    connection.executescript(tables_sql)
+    if 'way_geometry' in fields:
+        connection.executescript(WAY_GEOMETRY_SQL)
+    connection.execute('BEGIN')
+    writers = {key: TableWriter(connection, table_names[key], fields[key])
+               for key in fields}
+    return connection, writers
+
+
+def close_database(connection, writers, summaries=True):
+    """Flush remaining rows, commit, then build the indexes and summaries
+
+    summaries=False skips the osm_queries summary tables, which need the
+    plain tag tables.
+    """
+    for writer in writers.values():
+        writer.flush()
+    connection.execute('COMMIT')
+    connection.executescript(INDEXES_SQL)
+    if summaries:
+        osm_queries.build_summaries(connection)
+    connection.execute('PRAGMA journal_mode = DELETE')
+    connection.close()
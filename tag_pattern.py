@@ -2,76 +2,52 @@
 finding tag patterns in the dataset to look for problematic lines
 '''
 
-import xml.etree.ElementTree as ET
-import re
 import pprint
 
+from key_profile import profile_keys, PATTERNS
+
 osm_file = 'SAMPLE_OSM.osm'
 
 # list all tags in file
-def tag_patterns(filename):
-    k_patterns = {}
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'tag':
-            k = element.attrib['k']
-            if k not in k_patterns:
-                k_patterns[k] = 1
-            elif k in k_patterns:
-                k_patterns[k] += 1
-    return k_patterns
+def tag_patterns(filename, profile=None):
+    if profile is None:
+        profile = profile_keys(filename)
+    return dict(profile.key_counts)
 
 # look for acceptable patterns, tags with a single colon, and tags with problematic characters
-
-# list of patterns to search for
-LOWER = re.compile(r'^([a-z]|_)*$', re.IGNORECASE)
-LOWER_COLON = re.compile(r'^([a-z]|_)*:([a-z]|_)*$', re.IGNORECASE)
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]', re.IGNORECASE)
-
-# keys to fill in
-keys = {'lower': 0, 'lower_colon': 0, 'problemchars': 0,
-       'other': 0}
-key_types = {'lower': [],
-            'lower_colon': [],
-            'problemchars': [],
-            'other': []}
-
-# return counts for each pattern
-def key_pattern_count(filename, keys):
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'tag':
-            k = element.attrib['k']
-            if LOWER.search(k):
-                keys['lower'] += 1
-            elif LOWER_COLON.search(k):
-                keys['lower_colon'] += 1
-            elif PROBLEMCHARS.search(k):
-                keys['problemchars'] += 1
-            else:
-                keys['other'] += 1
+# (the patterns and the classification are in key_profile)
+
+# return counts for each pattern, added to keys if given
+def key_pattern_count(filename, keys=None, profile=None):
+    if keys is None:
+        keys = dict.fromkeys(PATTERNS, 0)
+    if profile is None:
+        profile = profile_keys(filename)
+    for pattern, count in profile.pattern_counts.items():
+        keys[pattern] += count
     return keys
 
-# return cases satisfying each pattern
-def key_patterns_print(filename, key_types):
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'tag':
-            k = element.attrib['k']
-            if LOWER.search(k):
-                if k not in key_types['lower']:
-                    key_types['lower'].append(k)
-            elif LOWER_COLON.search(k):
-                if k not in key_types['lower_colon']:
-                    key_types['lower_colon'].append(k)
-            elif PROBLEMCHARS.search(k):
-                if k not in key_types['problemchars']:
-                    key_types['problemchars'].append(k)
-            else:
-                if k not in key_types['other']:
-                    key_types['other'].append(k)
+# return cases satisfying each pattern, added to key_types if given
+def key_patterns_print(filename, key_types=None, profile=None):
+    if key_types is None:
+        key_types = {pattern: [] for pattern in PATTERNS}
+    if profile is None:
+        profile = profile_keys(filename)
+    for pattern, keys in profile.keys_by_pattern().items():
+        seen = set(key_types[pattern])
+        key_types[pattern].extend(k for k in keys if k not in seen)
     return key_types
 
-print('all tag patterns in ', str(osm_file))
-print('\n',tag_patterns(osm_file))
-print('\ncounts for each key pattern: ')
-print('\n',key_pattern_count(osm_file, keys))
-print('\nexamples of each type of key pattern:')
-print('\n',key_patterns_print(osm_file, key_types))
+# print all three reports from one pass over the file
+# (with cache_dir, from a parse_cache there)
+def print_patterns(filename, cache_dir=None):
+    profile = profile_keys(filename, cache_dir=cache_dir)
+    print('all tag patterns in ', str(filename))
+    print('\n',tag_patterns(filename, profile))
+    print('\ncounts for each key pattern: ')
+    print('\n',key_pattern_count(filename, profile=profile))
+    print('\nexamples of each type of key pattern:')
+    print('\n',key_patterns_print(filename, profile=profile))
+
+if __name__ == '__main__':
+    print_patterns(osm_file)
@@ -0,0 +1,10 @@
+import os
+import subprocess
+import sys
+
+
+def test_import_does_not_load_pyarrow():
+    code = 'import sys, csv_convert; print("pyarrow" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert output.strip() == b'False'
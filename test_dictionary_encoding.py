@@ -0,0 +1,32 @@
+import sqlite3
+
+import csv_convert
+
+
+def rows(db_path, sql):
+    connection = sqlite3.connect(db_path)
+    try:
+        return sorted(connection.execute(sql).fetchall())
+    finally:
+        connection.close()
+
+
+def test_views_decode_to_the_plain_tables(osm_file):
+    csv_convert.process_map(osm_file, validate='fast', db_path='plain.db')
+    csv_convert.process_map(osm_file, validate='fast', db_path='encoded.db',
+                            dictionary=True)
+    for table in ['node_tags', 'way_tags', 'relation_tags']:
+        assert (rows('encoded.db', 'SELECT id, key, value, type FROM {}_text'.format(table)) ==
+                rows('plain.db', 'SELECT id, key, value, type FROM {}'.format(table)))
+    for table in ['nodes', 'ways', 'relations']:
+        sql = 'SELECT id, user, uid, version, changeset, timestamp FROM {}'
+        assert rows('encoded.db', sql.format(table + '_text')) == rows('plain.db', sql.format(table))
+
+
+def test_dictionary_with_geometry(osm_file):
+    csv_convert.process_map(osm_file, validate='fast', db_path='plain.db', geometry=True)
+    csv_convert.process_map(osm_file, validate='fast', db_path='encoded.db',
+                            dictionary=True, geometry=True)
+    sql = 'SELECT * FROM way_geometry'
+    assert rows('encoded.db', sql) == rows('plain.db', sql)
+    assert len(rows('encoded.db', sql)) == 400
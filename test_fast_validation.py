@@ -0,0 +1,84 @@
+import copy
+import random
+
+import cerberus
+import pytest
+
+import csv_convert
+import fast_validation
+import osm_parser
+
+# values put in place of a valid one
+BAD_VALUES = [None, '', 'x', '12a', -1, 1.5, [], {}, 'EH1 1YZ']
+
+
+def shaped_elements(filename):
+    elements = []
+    for element in osm_parser.iter_elements(filename):
+        el = csv_convert.shape_element(element)
+        # plain lists and dicts, so the corrupted copies can be edited
+        elements.append({table: dict(value) if isinstance(value, dict)
+                         else [dict(row) for row in value]
+                         for table, value in el.items()})
+    return elements
+
+
+def corrupt(el, rand):
+    """Break one to three fields, rows or tables of a shaped element"""
+    el = copy.deepcopy(el)
+    for _ in range(rand.randint(1, 3)):
+        table = rand.choice(sorted(el))
+        value = el[table]
+        rows = [value] if isinstance(value, dict) else value
+        action = rand.random()
+        if not isinstance(rows, list) or not rows or action < 0.1:
+            el[rand.choice([table, 'extra_table'])] = rand.choice(BAD_VALUES)
+            continue
+        row = rand.choice(rows)
+        if not row:
+            continue
+        field = rand.choice(sorted(row))
+        if action < 0.2:
+            del row[field]
+        elif action < 0.3:
+            row['extra_field'] = 'x'
+        else:
+            row[field] = rand.choice(BAD_VALUES)
+    return el
+
+
+def messages(validate, el):
+    try:
+        validate(el)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+@pytest.fixture
+def validators():
+    validator = cerberus.Validator()
+    checkers = fast_validation.compile_schema(csv_convert.SCHEMA)
+    return (lambda el: csv_convert.validate_element(el, validator),
+            lambda el: fast_validation.validate_batch([el], checkers))
+
+
+def test_valid_elements_pass(osm_file, validators):
+    slow, fast = validators
+    for el in shaped_elements(osm_file):
+        assert messages(slow, el) is None
+        assert messages(fast, el) is None
+
+
+def test_invalid_elements_give_the_cerberus_errors(osm_file, validators):
+    slow, fast = validators
+    rand = random.Random(0)
+    elements = shaped_elements(osm_file)
+    for _ in range(1000):
+        el = corrupt(rand.choice(elements), rand)
+        assert messages(fast, el) == messages(slow, el)
+
+
+def test_unsupported_rules_are_refused():
+    with pytest.raises(ValueError):
+        fast_validation.compile_schema({'node': {'type': 'dict', 'maxlength': 3}})
@@ -0,0 +1,33 @@
+import pytest
+
+import benchmark
+
+# the budget given to every entry point, in MB
+LIMIT_MB = 100
+
+# how far over the budget the peak may go: the resident size is only
+# checked every few thousand elements
+SLACK_MB = 5
+
+# peak rss at 10x the input over the peak at 1x
+MAX_GROWTH = 1.15
+
+
+@pytest.fixture(scope='module')
+def extracts(tmp_path_factory):
+    """An extract and one 10x its size, written once for every entry point"""
+    workdir = tmp_path_factory.mktemp('memory')
+    benchmark.write_synthetic_osm(str(workdir / 'small.osm'), 50000, 10000,
+                                  n_relations=500)
+    benchmark.write_synthetic_osm(str(workdir / 'large.osm'), 500000, 100000,
+                                  n_relations=5000)
+    return workdir
+
+
+@pytest.mark.parametrize('entry', benchmark.MEMORY_ENTRIES)
+def test_peak_memory_stays_flat_and_within_the_budget(extracts, monkeypatch, entry):
+    monkeypatch.chdir(extracts)
+    small = benchmark.measure_peak('small.osm', entry, LIMIT_MB)
+    large = benchmark.measure_peak('large.osm', entry, LIMIT_MB)
+    assert large <= LIMIT_MB + SLACK_MB
+    assert large / small < MAX_GROWTH
@@ -0,0 +1,102 @@
+import copy
+import random
+import sqlite3
+import xml.etree.ElementTree as ET
+
+import csv_convert
+import osc_update
+import osm_queries
+from osm_parser import TOP_LEVEL_TAGS
+
+TABLES = ['nodes', 'node_tags', 'ways', 'way_nodes', 'way_tags',
+          'relations', 'relation_members', 'relation_tags']
+
+
+def make_diff(file_in, file_out, osc_file, seed=0):
+    """Write file_out, file_in with some elements created, modified and
+    deleted, and the osmChange file that turns one into the other"""
+    rand = random.Random(seed)
+    root = ET.parse(file_in).getroot()
+    osc = ET.Element('osmChange', version='0.6')
+    blocks = {action: ET.SubElement(osc, action) for action in osc_update.ACTIONS}
+
+    for elem in list(root):
+        if elem.tag not in TOP_LEVEL_TAGS:
+            continue
+        x = rand.random()
+        if x < 0.05:
+            root.remove(elem)
+            deleted = copy.deepcopy(elem)
+            deleted.set('version', str(int(elem.get('version')) + 1))
+            blocks['delete'].append(deleted)
+        elif x < 0.15:
+            elem.set('version', str(int(elem.get('version')) + 1))
+            elem.set('changeset', '777')
+            for tag in elem.findall('tag'):
+                if rand.random() < 0.5:
+                    elem.remove(tag)
+            ET.SubElement(elem, 'tag', k='addr:street', v='Foo Rd')
+            if elem.tag == 'way':
+                ET.SubElement(elem, 'nd', ref='1')
+            blocks['modify'].append(copy.deepcopy(elem))
+
+    # new elements go after the last one of their kind, as in an extract
+    attrib = {'version': '1', 'timestamp': '2017-01-01T00:00:00Z', 'changeset': '9',
+              'uid': '1', 'user': 'new'}
+    created = []
+    for i in range(5):
+        node = ET.Element('node', id=str(900000 + i), lat='55.9', lon='-3.1', **attrib)
+        ET.SubElement(node, 'tag', k='phone', v='01316542777')
+        created.append(node)
+    way = ET.Element('way', id='910000', **attrib)
+    for i in range(5):
+        ET.SubElement(way, 'nd', ref=str(900000 + i))
+    ET.SubElement(way, 'tag', k='highway', v='residential')
+    created.append(way)
+    relation = ET.Element('relation', id='920000', **attrib)
+    ET.SubElement(relation, 'member', type='way', ref='910000', role='outer')
+    ET.SubElement(relation, 'tag', k='type', v='multipolygon')
+    created.append(relation)
+    for elem in created:
+        last = max(i for i, e in enumerate(root) if e.tag == elem.tag)
+        root.insert(last + 1, elem)
+        blocks['create'].append(copy.deepcopy(elem))
+
+    ET.ElementTree(root).write(file_out, encoding='UTF-8', xml_declaration=True)
+    ET.ElementTree(osc).write(osc_file, encoding='UTF-8', xml_declaration=True)
+
+
+def dump(db_path):
+    """Every table and summary of a database, with rows sorted"""
+    connection = sqlite3.connect(db_path)
+    try:
+        tables = {table: sorted(connection.execute('SELECT * FROM ' + table).fetchall(),
+                                key=repr)
+                  for table in TABLES}
+        tables['table_counts'] = osm_queries.table_counts(connection)
+        for summary in ['tag_counts', 'user_counts']:
+            tables[summary] = sorted(connection.execute(
+                'SELECT * FROM {} WHERE num > 0'.format(summary)).fetchall(), key=repr)
+        return tables
+    finally:
+        connection.close()
+
+
+def test_diff_gives_the_same_database_as_a_rebuild(osm_file):
+    make_diff(osm_file, 'new.osm', 'diff.osc')
+    csv_convert.process_map(osm_file, validate='fast', db_path='updated.db')
+    counts = osc_update.apply_changes('diff.osc', 'updated.db', validate='fast')
+    assert counts['create'] == 7 and counts['modify'] and counts['delete']
+    assert counts['skipped'] == 0
+    csv_convert.process_map('new.osm', validate='fast', db_path='rebuilt.db')
+    assert dump('updated.db') == dump('rebuilt.db')
+
+
+def test_replaying_a_diff_changes_nothing(osm_file):
+    make_diff(osm_file, 'new.osm', 'diff.osc')
+    csv_convert.process_map(osm_file, validate='fast', db_path='updated.db')
+    counts = osc_update.apply_changes('diff.osc', 'updated.db')
+    before = dump('updated.db')
+    replayed = osc_update.apply_changes('diff.osc', 'updated.db')
+    assert replayed['skipped'] == sum(counts.values())
+    assert dump('updated.db') == before
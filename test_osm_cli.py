@@ -0,0 +1,22 @@
+import pytest
+
+import osm_cli
+
+
+@pytest.mark.parametrize('command', ['count', 'patterns'])
+def test_backend_is_not_offered_where_it_is_ignored(command, capsys):
+    with pytest.raises(SystemExit):
+        osm_cli.make_parser().parse_args([command, 'test.osm', '--backend', 'etree'])
+    assert 'unrecognized arguments: --backend' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('command', ['audit', 'clean-report', 'convert'])
+def test_backend_is_offered_where_it_is_used(command):
+    args = osm_cli.make_parser().parse_args([command, 'test.osm', '--backend', 'etree'])
+    assert args.backend == 'etree'
+
+
+def test_dictionary_needs_a_database(capsys):
+    with pytest.raises(SystemExit):
+        osm_cli.main(['convert', 'test.osm', '--dictionary'])
+    assert '--dictionary needs --db' in capsys.readouterr().err
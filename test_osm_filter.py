@@ -0,0 +1,159 @@
+import csv
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import csv_convert
+from osm_filter import BBox, Polygon, ElementFilter
+
+# a triangle with a vertex at lat 1, in (lat, lon)
+TRIANGLE = [(0, 0), (1, 2), (2, 0)]
+# an L shape: its bounding box is 0..2 x 0..2, the notch 1..2 x 1..2 is outside
+L_SHAPE = [(0, 0), (0, 2), (1, 2), (1, 1), (2, 1), (2, 0)]
+
+
+@pytest.mark.parametrize('lat, lon, inside', [
+    (1, 0.5, True),     # the ray east passes through the vertex at (1, 2)
+    (0.2, 0.1, True),
+    (0.2, 1.8, False),  # inside the bounding box, outside the triangle
+    (1.8, 1.8, False),
+    (1, 2.5, False),    # level with the vertex, past it
+    (3, 1, False),
+])
+def test_polygon_contains_triangle(lat, lon, inside):
+    assert Polygon(TRIANGLE).contains(lat, lon) == inside
+
+
+@pytest.mark.parametrize('lat, lon, inside', [
+    (0.5, 1.5, True),
+    (1.5, 0.5, True),
+    (1.5, 1.5, False),  # in the notch
+    (1, 0.5, True),     # level with the horizontal edges
+    (0.5, 1, True),     # level with no vertex, below the inner corner
+    (-0.5, 1, False),
+])
+def test_polygon_contains_concave(lat, lon, inside):
+    assert Polygon(L_SHAPE).contains(lat, lon) == inside
+
+
+def test_polygon_rejects_points_outside_its_bbox_first():
+    polygon = Polygon(TRIANGLE)
+    # the edges are never walked for a point outside the bounding box
+    polygon.points = None
+    assert not polygon.contains(2.5, 1)
+    assert not polygon.contains(1, -0.1)
+    with pytest.raises(TypeError):
+        polygon.contains(1, 1)
+
+
+def test_bbox_includes_its_edges():
+    bbox = BBox(55.9, -3.3, 56.0, -3.1)
+    assert bbox.contains(55.9, -3.3)
+    assert bbox.contains(56.0, -3.1)
+    assert not bbox.contains(56.0001, -3.2)
+    assert not bbox.contains(55.95, -3.0999)
+
+
+def node(node_id, lat, lon, **tags):
+    element = ET.Element('node', id=str(node_id), lat=str(lat), lon=str(lon))
+    for k, v in tags.items():
+        ET.SubElement(element, 'tag', k=k, v=v)
+    return element
+
+
+def way(way_id, refs, **tags):
+    element = ET.Element('way', id=str(way_id))
+    for ref in refs:
+        ET.SubElement(element, 'nd', ref=str(ref))
+    for k, v in tags.items():
+        ET.SubElement(element, 'tag', k=k, v=v)
+    return element
+
+
+def relation(relation_id, members, **tags):
+    element = ET.Element('relation', id=str(relation_id))
+    for member_type, ref in members:
+        ET.SubElement(element, 'member', type=member_type, ref=str(ref), role='')
+    for k, v in tags.items():
+        ET.SubElement(element, 'tag', k=k, v=v)
+    return element
+
+
+def extract():
+    """Nodes 1 and 2 inside the unit square, 3 and 4 outside, then the
+    ways and relations that use them, in file order"""
+    return [
+        node(1, 0.5, 0.5, amenity='cafe'),
+        node(2, 0.2, 0.8),
+        node(3, 5, 5, amenity='cafe'),
+        node(4, 6, 6),
+        way(10, [3, 2], highway='residential'),   # one node inside
+        way(11, [3, 4], highway='residential'),   # no node inside
+        way(12, [1, 2]),                          # inside, without tags
+        relation(20, [('way', 10)], type='route'),
+        relation(21, [('node', 4), ('way', 11)], type='route'),
+        relation(22, [('node', 1)]),
+        relation(23, [('relation', 20)], type='super'),
+    ]
+
+
+def kept(element_filter):
+    return [(e.tag, int(e.attrib['id'])) for e in element_filter(extract())]
+
+
+def test_area_keeps_what_references_selected_nodes():
+    element_filter = ElementFilter(area=BBox(0, 0, 1, 1))
+    assert kept(element_filter) == [('node', 1), ('node', 2), ('way', 10), ('way', 12),
+                                    ('relation', 20), ('relation', 22), ('relation', 23)]
+    assert element_filter.node_ids == {1, 2}
+    assert element_filter.way_ids == {10, 12}
+    assert element_filter.relation_ids == {20, 22, 23}
+
+
+def test_tags_alone_ignore_positions():
+    element_filter = ElementFilter(tags={'amenity': ['cafe'], 'type': None})
+    assert kept(element_filter) == [('node', 1), ('node', 3), ('relation', 20),
+                                    ('relation', 21), ('relation', 23)]
+
+
+def test_tags_and_area_together():
+    element_filter = ElementFilter(area=Polygon([(0, 0), (0, 1), (1, 1), (1, 0)]),
+                                   tags={'amenity': ['cafe'], 'highway': None})
+    # node 2 has no wanted tag, yet way 10 is kept for running through it
+    assert kept(element_filter) == [('node', 1), ('way', 10)]
+    assert element_filter.node_ids == {1, 2}
+    assert element_filter.way_ids == {10, 12}
+
+
+def test_tags_match_only_the_listed_values():
+    element_filter = ElementFilter(tags={'amenity': ['pub'], 'highway': ['primary']})
+    assert kept(element_filter) == []
+
+
+def read_ids(path, column='id'):
+    with open(path) as f:
+        return {int(row[column]) for row in csv.DictReader(f)}
+
+
+def test_process_map_writes_only_the_filtered_elements(osm_file):
+    bbox = BBox(55.9, -3.3, 55.95, -3.2)
+    csv_convert.process_map(osm_file, validate=False, element_filter=ElementFilter(bbox))
+
+    with open(csv_convert.NODES_PATH) as f:
+        nodes = list(csv.DictReader(f))
+    assert nodes
+    assert all(bbox.contains(float(n['lat']), float(n['lon'])) for n in nodes)
+    node_ids = {int(n['id']) for n in nodes}
+
+    # every way written runs through at least one node written
+    way_nodes = {}
+    with open(csv_convert.WAY_NODES_PATH) as f:
+        for row in csv.DictReader(f):
+            way_nodes.setdefault(int(row['id']), set()).add(int(row['node_id']))
+    assert way_nodes
+    assert read_ids(csv_convert.WAYS_PATH) == set(way_nodes)
+    assert all(refs & node_ids for refs in way_nodes.values())
+
+    relation_ids = read_ids(csv_convert.RELATIONS_PATH)
+    assert relation_ids
+    assert relation_ids == read_ids(csv_convert.RELATION_MEMBERS_PATH)
@@ -0,0 +1,66 @@
+import bz2
+
+import pytest
+
+import osm_parser
+from benchmark import write_synthetic_osm
+
+
+def parsed(filename, backend, tags):
+    return [(el.tag, el.attrib['id'], [(child.tag, dict(child.attrib)) for child in el])
+            for el in osm_parser.iter_elements(filename, tags=tags, backend=backend)]
+
+
+@pytest.mark.parametrize('backend', sorted(osm_parser.BACKENDS))
+@pytest.mark.parametrize('tags', [osm_parser.TOP_LEVEL_TAGS, ('node', 'way'), ('relation',)])
+def test_backends_agree(osm_file, backend, tags):
+    if backend == 'lxml' and osm_parser.lxml_etree is None:
+        pytest.skip('lxml is not installed')
+    assert parsed(osm_file, backend, tags) == parsed(osm_file, 'etree', tags)
+
+
+def test_lxml_forgets_elements_it_skips(tmp_path):
+    if osm_parser.lxml_etree is None:
+        pytest.skip('lxml is not installed')
+    filename = str(tmp_path / 'relations.osm')
+    write_synthetic_osm(filename, 200, 50, n_relations=2000)
+    root = None
+    for el in osm_parser.iter_elements(filename, tags=('node', 'way'), backend='lxml'):
+        root = el.getparent()
+    # the relations after the last way were parsed but not yielded
+    assert len(root) <= 1
+
+
+def write_multistream_bz2(filename, data, stream_size):
+    """Compress data as one bz2 stream per stream_size bytes, like pbzip2"""
+    with open(filename, 'wb') as f:
+        for i in range(0, len(data), stream_size):
+            f.write(bz2.compress(data[i:i + stream_size]))
+
+
+def test_parallel_bz2_reader_stays_within_its_buffer(tmp_path):
+    osm = str(tmp_path / 'big.osm')
+    write_synthetic_osm(osm, 20000, 4000, n_relations=100)
+    with open(osm, 'rb') as f:
+        data = f.read()
+    filename = osm + '.bz2'
+    # streams bigger than the jobs the buffer size asks for
+    write_multistream_bz2(filename, data, 256 << 10)
+    buffer_size = 1 << 20
+
+    with osm_parser.ParallelBZ2Reader(filename, processes=4,
+                                      buffer_size=buffer_size) as reader:
+        # the decompressed size of every range the reader will hand out
+        sizes = {(start, end): len(osm_parser.decompress_range((filename, start, end)))
+                 for start, end in reader.ranges}
+        assert len(sizes) > 10
+        chunks = []
+        while True:
+            chunk = reader.read(osm_parser.CHUNK_SIZE // 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            held = (sum(sizes[start, end] for start, end, job in reader.pending) +
+                    len(reader.buffer) - reader.position)
+            assert held <= buffer_size
+    assert b''.join(chunks) == data
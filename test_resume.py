@@ -0,0 +1,108 @@
+import json
+import os
+
+import pytest
+
+import csv_convert
+
+
+class Crash(Exception):
+    pass
+
+
+def read_csvs():
+    outputs = {}
+    for path in csv_convert.CSV_PATHS:
+        with open(path, 'rb') as f:
+            outputs[path] = f.read()
+    return outputs
+
+
+def crash_after(segments, elements):
+    """A write_csvs that raises once segments calls are done and elements
+    more elements of the next one are written"""
+    write_csvs = csv_convert.write_csvs
+    calls = []
+
+    def crashing(elements_in, *args, **kwargs):
+        calls.append(None)
+        # the first call only writes the headers
+        if len(calls) <= segments + 1:
+            return write_csvs(elements_in, *args, **kwargs)
+
+        def until_crash():
+            for i, element in enumerate(elements_in):
+                if i == elements:
+                    raise Crash()
+                yield element
+        return write_csvs(until_crash(), *args, **kwargs)
+    return crashing
+
+
+@pytest.mark.parametrize('elements', [0, 50])
+def test_resume_gives_the_same_csvs(osm_file, monkeypatch, elements):
+    monkeypatch.setattr(csv_convert, 'SEGMENT_SIZE', 20000)
+    checkpoint = csv_convert.CHECKPOINT_PATH
+    assert len(csv_convert.find_segments(osm_file, 0, 20000)) > 3
+    clean_counts = csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint)
+    clean = read_csvs()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(csv_convert, 'write_csvs', crash_after(3, elements))
+        with pytest.raises(Crash):
+            csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint)
+    with open(checkpoint) as f:
+        outputs = json.load(f)['outputs']
+    # a crash mid-segment leaves some of its rows past the checkpoint
+    grown = [path for path, size in outputs.items() if os.path.getsize(path) > size]
+    assert bool(grown) == bool(elements)
+
+    counts = csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint,
+                                               resume=True)
+    assert read_csvs() == clean
+    assert counts == clean_counts == {'node': 2000, 'way': 400, 'relation': 30}
+    assert not os.path.exists(checkpoint)
+
+
+def test_resume_ignores_the_checkpoint_of_another_file(osm_file, monkeypatch):
+    monkeypatch.setattr(csv_convert, 'SEGMENT_SIZE', 20000)
+    checkpoint = csv_convert.CHECKPOINT_PATH
+    # another extract of exactly the same size
+    with open(osm_file, 'rb') as f:
+        data = f.read()
+    other_data = data.replace(b'v="Edinburgh"', b'v="Edinburgx"')
+    other = 'other.osm'
+    with open(other, 'wb') as f:
+        f.write(other_data)
+    assert os.path.getsize(other) == os.path.getsize(osm_file) and other_data != data
+    csv_convert.process_map_resumable(other, False, checkpoint_path=checkpoint)
+    clean = read_csvs()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(csv_convert, 'write_csvs', crash_after(3, 50))
+        with pytest.raises(Crash):
+            csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint)
+    csv_convert.process_map_resumable(other, False, checkpoint_path=checkpoint, resume=True)
+    assert read_csvs() == clean
+
+
+def test_resume_starts_over_when_the_file_changed(osm_file, monkeypatch):
+    monkeypatch.setattr(csv_convert, 'SEGMENT_SIZE', 20000)
+    checkpoint = csv_convert.CHECKPOINT_PATH
+    with monkeypatch.context() as patch:
+        patch.setattr(csv_convert, 'write_csvs', crash_after(3, 50))
+        with pytest.raises(Crash):
+            csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint)
+    # edited in place, to the same size
+    with open(osm_file, 'rb') as f:
+        data = f.read()
+    with open(osm_file, 'wb') as f:
+        f.write(data.replace(b'v="Edinburgh"', b'v="Edinburgx"'))
+    stat = os.stat(osm_file)
+    os.utime(osm_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint,
+                                      resume=True)
+    resumed = read_csvs()
+    csv_convert.process_map_resumable(osm_file, False, checkpoint_path=checkpoint)
+    assert resumed == read_csvs()
@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from updated_values import (update_street, update_city, update_number, update_numbers,
+                            street_cleaner, city_cleaner, number_cleaner,
+                            street_mapping, city_mapping, changed_names, load_rules)
+
+# known before -> after pairs, from the writeup
+KNOWN_STREETS = [
+    ('Duddingston Gardens North', 'Duddingston Gardens'),
+    ('Railway Path South', 'Railway Path'),
+    ('St James place', 'St James Place'),
+    ('Mayburn Ave', 'Mayburn Avenue'),
+    ('Logie Green Rd', 'Logie Green Road'),
+    ('Princes Street', 'Princes Street')
+]
+KNOWN_CITIES = [
+    ('Ed', 'Edinburgh'),
+    ('Penicuick', 'Penicuik'),
+    ('Edinburgh', 'Edinburgh')
+]
+KNOWN_NUMBERS = [
+    ('+44 131 447 9027', '0131 447 9027'),
+    ('+44 (0)131 656 0390', '0131 656 0390'),
+    ('01316542777', '0131 654 2777'),
+    ('+44 788 983 2780', '07889 832780'),
+    ('+44 131 5525522', '0131 552 5522'),
+    ('0131 556 1234', '0131 556 1234')
+]
+
+
+@pytest.mark.parametrize('before, after', KNOWN_STREETS)
+def test_known_streets(before, after):
+    assert update_street(before, street_mapping) == after
+    clean = street_cleaner(street_mapping)
+    # the second call comes from the cache
+    assert clean(before) == clean(before) == after
+    assert clean.cache_info().hits == 1
+
+
+@pytest.mark.parametrize('before, after', KNOWN_CITIES)
+def test_known_cities(before, after):
+    assert update_city(before, city_mapping) == after
+    clean = city_cleaner(city_mapping)
+    assert clean(before) == clean(before) == after
+    assert clean.cache_info().hits == 1
+
+
+@pytest.mark.parametrize('before, after', KNOWN_NUMBERS)
+def test_known_numbers(before, after):
+    assert update_number(before) == after
+    clean = number_cleaner()
+    assert clean(before) == clean(before) == after
+    assert clean.cache_info().hits == 1
+    assert update_numbers([before]) == [after]
+
+
+# pieces phone values are made of, weighted towards the shapes of
+# update_number's branches
+PREFIXES = ['', '', '0', '0131 ', '+44 ', '+44', '+44 (0)', '+44 (0) ', '+44-', ' +44 ',
+            '0044 ', '(0131) ', '+44 131', '+44 800 ', '+44 0800 ', '+44 7']
+PIECES = ['0', '1', '3', '7', '8', '131', '800', '0131', ' ', ' ', '-', '(', ')', '(0)',
+          '+44', 'x', 'ext ', '\xa0', '.']
+
+
+def random_number(rand):
+    if rand.random() < 0.05:
+        return '0131 {:03} {:04}'.format(rand.randint(0, 999), rand.randint(0, 9999))
+    number = rand.choice(PREFIXES)
+    for _ in range(rand.randint(0, 5)):
+        if rand.random() < 0.7:
+            number += str(rand.randint(0, 10 ** rand.randint(1, 7)))
+        else:
+            number += rand.choice(PIECES)
+    return number
+
+
+def cleaned(number):
+    """update_number(number), or the type of the exception it raises"""
+    try:
+        return update_number(number)
+    except Exception as e:
+        return type(e)
+
+
+def test_update_numbers_matches_update_number():
+    rand = random.Random(0)
+    values = [random_number(rand) for _ in range(20000)]
+    # repeats, as in a real extract
+    values += [rand.choice(values) for _ in range(5000)]
+    expected = {v: cleaned(v) for v in values}
+    raising = {v for v in values if isinstance(expected[v], type)}
+    assert raising
+
+    valid = [v for v in values if v not in raising]
+    assert update_numbers(valid) == [update_number(v) for v in valid]
+    assert update_numbers(iter(valid)) == update_numbers(valid)
+    for v in raising:
+        with pytest.raises(expected[v]):
+            update_numbers(valid[:10] + [v])
+
+
+@pytest.mark.parametrize('number', ['', ' ', '+44', '+44 (131 1234', '+44 )',
+                                    '+44 (0)', '+44-', '0', '131'])
+def test_update_numbers_edge_cases(number):
+    expected = cleaned(number)
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            update_numbers([number])
+    else:
+        assert update_numbers([number]) == [expected]
+
+
+def test_changed_names_takes_the_mappings(osm_file, capsys):
+    # the form used before the rules config
+    changed_names(osm_file, street_mapping, city_mapping)
+    with_mappings = capsys.readouterr().out
+    changed_names(osm_file, rules=load_rules())
+    assert 'values updated' in with_mappings
+    assert capsys.readouterr().out == with_mappings
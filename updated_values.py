@@ -1,6 +1,10 @@
-import xml.etree.ElementTree as ET
+import collections
+import functools
+import json
+import os
 import re
-import pprint
+
+import parse_cache
 
 osm_file = 'SAMPLE_OSM.osm'
 
@@ -14,6 +18,9 @@ street_mapping = {
     'Pl': 'Place'
 }
 
+# directions should be get rid of to replace it with the decsriptions before
+directions = frozenset(['East', 'North', 'South', 'West'])
+
 # let's get rid of those directions
 def no_directions(name):
     name = name.split(' ')
@@ -25,12 +32,9 @@ def no_directions(name):
 def update_street(name, street_mapping):
     name_split = name.split(' ')
     
-    # directions should be get rid of to replace it with the decsriptions before
-    directions = ['East', 'North', 'South', 'West']
-    
     # return address without directions at the end
     if name_split[-1] in directions:
-        new_name = no_directions(name)
+        new_name = ' '.join(name_split[:-1])
         return new_name
     
     # change names by mapping faulty names to right one
@@ -58,11 +62,12 @@ def update_city(city, city_mapping):
         return city
 
 
+# right phone format, compiled once for every call of update_number
+phone_check = re.compile(r'(0131) \d\d\d \d\d\d\d')
+starts_131 = re.compile(r'^131*')
+
 # function to update phone number:
 def update_number(number):
-    # right format
-    phone_check = re.compile(r'(0131) \d\d\d \d\d\d\d')
-    
     # return original if number matches the right format
     if phone_check.match(number):
         return number
@@ -83,7 +88,7 @@ def update_number(number):
                 number = ' '.join([i_f,i_s,i_t])
                 
             # number code is 0131 but starts with 131
-            elif re.compile(r'^131*').match(number):
+            elif starts_131.match(number):
                 number = number.replace(' ','')
                 if len(number) == 10:
                     i_f = ''.join(['0', number[:3]])
@@ -96,7 +101,7 @@ def update_number(number):
             # number contains '()'
             elif "(" in number:
                 number = number.split(")")[1].replace(' ','')
-                if re.search(r'^800', number):
+                if number.startswith('800'):
                     i_f = ''.join(['0',number[:3]])
                     i_s = number[3:]
                     number = ' '.join([i_f,i_s])
@@ -107,7 +112,7 @@ def update_number(number):
                     number = ' '.join([i_f,i_s,i_t])
                     
             # number code is 0800
-            elif re.search(r'^800', number) or re.search(r'^0800', number):
+            elif number.startswith('800') or number.startswith('0800'):
                 number = number.replace(' ','')
                 i_f = ''.join(['0',number[:3]])
                 i_s = number[3:]
@@ -117,7 +122,7 @@ def update_number(number):
             else:
                 number = number.replace(' ','')
                 if len(number) == 9:
-                    if re.search(r'^3',number):
+                    if number.startswith('3'):
                         i_f = ''.join(['0',number[:3]])
                         i_s = number[3:6]
                         i_t = number[6:]
@@ -125,11 +130,11 @@ def update_number(number):
                     else:
                         return number
                 elif len(number) == 10:
-                    if re.search(r'^7',number):
+                    if number.startswith('7'):
                         i_f = ''.join(['0',number[:4]])
                         i_s = number[4:]
                         number = ' '.join([i_f,i_s])
-                    elif re.search(r'^8',number):
+                    elif number.startswith('8'):
                         i_f = ''.join(['0',number[:3]])
                         i_s = number[3:6]
                         i_t = number[6:]
@@ -139,7 +144,7 @@ def update_number(number):
                         i_s = number[4:]
                         number = ' '.join([i_f,i_s])
                 else:
-                    if re.search(r'^(0131)',number):
+                    if number.startswith('0131'):
                         i_f = number[:4]
                         i_s = number[4:7]
                         i_t = number[7:]
@@ -165,33 +170,165 @@ def update_number(number):
                 
     return number
 
+'''BATCH PHONE NORMALIZATION'''
+# phone values repeat a lot across an extract, so update_numbers cleans
+# each distinct value of a column once with update_number
+
+def update_numbers(numbers):
+    '''Return update_number of every value in numbers, as a list'''
+    if not isinstance(numbers, list):
+        numbers = list(numbers)
+    cleaned = {number: update_number(number) for number in dict.fromkeys(numbers)}
+    return list(map(cleaned.__getitem__, numbers))
+
+'''MEMOIZED CLEANERS'''
+# street, city and phone values repeat a lot across an extract,
+# so each distinct value is only cleaned once.
+# the cleaners give exactly the same output as the update_* functions
+CACHE_SIZE = 100000
+
+def street_cleaner(street_mapping, maxsize=CACHE_SIZE):
+    """Return a memoized update_street for this street_mapping
+
+    The mapping must not change after the cleaner is made.
+    """
+    @functools.lru_cache(maxsize=maxsize)
+    def clean_street(name):
+        return update_street(name, street_mapping)
+    return clean_street
+
+def city_cleaner(city_mapping, maxsize=CACHE_SIZE):
+    """Return a memoized update_city for this city_mapping"""
+    @functools.lru_cache(maxsize=maxsize)
+    def clean_city(city):
+        return update_city(city, city_mapping)
+    return clean_city
+
+def number_cleaner(maxsize=CACHE_SIZE):
+    """Return a memoized update_number"""
+    return functools.lru_cache(maxsize=maxsize)(update_number)
+
+def cache_report(cleaners):
+    """Return hits, misses and hit rate of each named cleaner"""
+    report = {}
+    for name, cleaner in cleaners.items():
+        info = cleaner.cache_info()
+        calls = info.hits + info.misses
+        report[name] = {'hits': info.hits, 'misses': info.misses,
+                        'size': info.currsize,
+                        'hit_rate': info.hits / calls if calls else 0.0}
+    return report
+
+'''CLEANING RULES'''
+# rules are loaded from a config file (see rules_edinburgh.json), so a new
+# city or a new rule is a config change rather than another if/elif.
+# each rule names the tag keys (or a key_pattern) it applies to and,
+# optionally, the cleaner used for their values
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'rules_edinburgh.json')
+
+# cleaner name -> function taking the rule and returning a cleaner for one value
+cleaner_factories = {
+    'street': lambda rule: street_cleaner(rule['mapping']),
+    'city': lambda rule: city_cleaner(rule['mapping']),
+    'phone': lambda rule: number_cleaner()
+}
+
+def register_cleaner(name, factory):
+    """Make a cleaner available to rules as "cleaner": name"""
+    cleaner_factories[name] = factory
+
+
+class CleaningRules(object):
+    """Compiled rules: a single dict lookup per tag key gives its rule and cleaner"""
+
+    def __init__(self, rules):
+        self.rules = {}
+        self.cleaners = {}
+        self.patterns = []
+        # tag key -> (rule name, cleaner or None), or None if no rule applies
+        self.dispatch = {}
+        for rule in rules:
+            name = rule['name']
+            self.rules[name] = rule
+            cleaner = None
+            if 'cleaner' in rule:
+                cleaner = cleaner_factories[rule['cleaner']](rule)
+                self.cleaners[name] = cleaner
+            for key in rule.get('keys', []):
+                self.dispatch.setdefault(key, (name, cleaner))
+            if 'key_pattern' in rule:
+                self.patterns.append((re.compile(rule['key_pattern']), name, cleaner))
+
+    def lookup(self, key):
+        """Return (rule name, cleaner) for a tag key, or None"""
+        try:
+            return self.dispatch[key]
+        except KeyError:
+            pass
+        # keys matched by pattern are resolved once, then found in dispatch
+        entry = None
+        for pattern, name, cleaner in self.patterns:
+            if pattern.match(key):
+                entry = (name, cleaner)
+                break
+        self.dispatch[key] = entry
+        return entry
+
+    def clean(self, key, value):
+        """Return the cleaned value of a tag"""
+        entry = self.lookup(key)
+        if entry is None or entry[1] is None:
+            return value
+        return entry[1](value)
+
+
+def load_rules(path=RULES_PATH):
+    """Read a rules config file and compile it"""
+    with open(path) as f:
+        return CleaningRules(json.load(f)['rules'])
+
+
+def mapping_rules(street_mapping, city_mapping):
+    """Rules cleaning streets and cities with these mappings, and phones"""
+    return CleaningRules([
+        {'name': 'street', 'keys': ['addr:street'], 'cleaner': 'street',
+         'mapping': street_mapping},
+        {'name': 'city', 'keys': ['addr:city'], 'cleaner': 'city', 'mapping': city_mapping},
+        {'name': 'phone', 'keys': ['phone', 'contact:phone'], 'cleaner': 'phone'}
+    ])
+
+
 # function to mark all changes
-def changed_names(filename, street_mapping, city_mapping):
+# values are cleaned with street_mapping and city_mapping if given,
+# as before the rules config, else with rules (default: load_rules())
+# with top, only the top most frequent changes are printed, with their counts
+# (see audit_attributes.normalization_report for the full ranked report)
+# with cache_dir the tags are read from a parse_cache there
+def changed_names(filename, street_mapping=None, city_mapping=None, rules=None,
+                  top=None, cache_dir=None):
+    if street_mapping is not None or city_mapping is not None:
+        rules = mapping_rules(street_mapping or {}, city_mapping or {})
+    elif rules is None:
+        rules = load_rules()
     count = 0
-    for event, element in ET.iterparse(filename):
-        if element.tag == 'node' or element.tag == 'way':
-            for tag in element.iter('tag'):
-                
-                # update street names
-                if tag.attrib['k'] == 'addr:street':
-                    new_name = update_street(tag.attrib['v'],street_mapping)
-                    if new_name != tag.attrib['v']:
-                        print('{} -> {}'.format(tag.attrib['v'], new_name))
-                        count += 1
-                elif tag.attrib['k'] == 'addr:city':
-                    new_name = update_city(tag.attrib['v'], city_mapping)
-                    if new_name != tag.attrib['v']:
-                        print('{} -> {}'.format(tag.attrib['v'], new_name))
-                        count += 1
-                elif tag.attrib['k'] == 'phone' or tag.attrib['k'] == 'contact:phone':
-                    new_name = update_number(tag.attrib['v'])
-                    if new_name != tag.attrib['v']:
-                        print('{} -> {}'.format(tag.attrib['v'], new_name))
-                        count += 1
+    changes = collections.Counter()
+    # the parser forgets each element once it is checked
+    for element in parse_cache.iter_elements(filename, tags=('node', 'way'),
+                                             cache_dir=cache_dir):
+        for tag in element.iter('tag'):
+            new_name = rules.clean(tag.attrib['k'], tag.attrib['v'])
+            if new_name != tag.attrib['v']:
+                if top is None:
+                    print('{} -> {}'.format(tag.attrib['v'], new_name))
+                else:
+                    changes[(tag.attrib['v'], new_name)] += 1
+                count += 1
+    for (old_name, new_name), n in changes.most_common(top):
+        print('{} -> {} ({})'.format(old_name, new_name, n))
     print('\nTotal {} values updated.'.format(count))
                 
 # call function                  
 # changed_names(osm_file, street_mapping, city_mapping)
 
 
-
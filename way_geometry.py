@@ -0,0 +1,172 @@
+'''
+length, bounding box and centroid of every way, computed while converting.
+
+ways list their nodes by id only, so every spatial question (the longest
+streets, the extent of a building, how much abandoned railway there is)
+used to need a join of way_nodes with nodes. osm files list every node
+before the first way, so by the time the ways arrive the NodeStore of
+the conversion knows all their coordinates: a WayGeometry collects the
+node refs of a few thousand ways, looks all of them up at once and
+writes one way_geometry row per way.
+
+- length: sum of the haversine distances between consecutive nodes, in m
+- min_lat, min_lon, max_lat, max_lon: bounding box
+- lat, lon: centroid, the mean of the nodes (the closing node of a
+  closed way is counted once)
+- missing_nodes: refs not found in the store, e.g. nodes clipped off the
+  extract. segments touching one add no length; a way with no node found
+  gets NULL geometry
+
+with NumPy every batch is computed with array operations; without it
+the same values are computed way by way.
+'''
+
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WAY_GEOMETRY_FIELDS = ['id', 'length', 'min_lat', 'min_lon', 'max_lat', 'max_lon',
+                       'lat', 'lon', 'missing_nodes']
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+# ways looked up and computed together
+BATCH_SIZE = 4096
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distance in meters between two points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def way_row(way_id, node_ids, nodes):
+    """The way_geometry row of one way, without NumPy"""
+    coords = [nodes.get(node_id) for node_id in node_ids]
+    found = [c for c in coords if c is not None]
+    missing = len(coords) - len(found)
+    if not found:
+        return (way_id, None, None, None, None, None, None, None, missing)
+    length = 0.0
+    for a, b in zip(coords, coords[1:]):
+        if a is not None and b is not None:
+            length += haversine(a[0], a[1], b[0], b[1])
+    lats = [c[0] for c in found]
+    lons = [c[1] for c in found]
+    # the closing node of a closed way repeats the first one
+    centre = coords[:-1] if len(coords) > 1 and node_ids[0] == node_ids[-1] else coords
+    centre = [c for c in centre if c is not None]
+    return (way_id, length, min(lats), min(lons), max(lats), max(lons),
+            sum(c[0] for c in centre) / len(centre),
+            sum(c[1] for c in centre) / len(centre), missing)
+
+
+def batch_rows(way_ids, node_id_arrays, nodes):
+    """The way_geometry rows of many ways, from one vectorized lookup
+
+    node_id_arrays holds the int64 node refs of each way, e.g. the
+    node_ids of a node_store.WayNodes.
+    """
+    counts = np.array([len(ids) for ids in node_id_arrays], dtype=np.int64)
+    if not counts.all():
+        # a way without nodes has no geometry; compute the others
+        rows = {}
+        keep = [i for i, n in enumerate(counts) if n]
+        for i, n in enumerate(counts):
+            if not n:
+                rows[i] = (way_ids[i], None, None, None, None, None, None, None, 0)
+        if keep:
+            kept = batch_rows([way_ids[i] for i in keep],
+                              [node_id_arrays[i] for i in keep], nodes)
+            rows.update(zip(keep, kept))
+        return [rows[i] for i in range(len(way_ids))]
+
+    ids = np.concatenate([np.frombuffer(a, dtype=np.int64) if isinstance(a, array)
+                          else np.asarray(a, dtype=np.int64) for a in node_id_arrays])
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    ends = starts + counts - 1
+
+    lats, lons = nodes.coordinates(ids)
+    found = (~np.isnan(lats)).astype(np.int64)
+
+    # haversine between each node and the next; the pair after the last
+    # node of a way belongs to no way and is zeroed
+    phi = np.radians(lats)
+    lam = np.radians(lons)
+    a = (np.sin(np.diff(phi) / 2) ** 2 +
+         np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2)
+    segments = np.zeros(len(ids))
+    segments[:-1] = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+    segments[ends] = 0.0
+    lengths = np.add.reduceat(np.nan_to_num(segments), starts)
+
+    with np.errstate(invalid='ignore'):
+        min_lats = np.fmin.reduceat(lats, starts)
+        min_lons = np.fmin.reduceat(lons, starts)
+        max_lats = np.fmax.reduceat(lats, starts)
+        max_lons = np.fmax.reduceat(lons, starts)
+
+    # count the closing node of a closed way once, as way_row does
+    closed = (counts > 1) & (ids[starts] == ids[ends])
+    centre = found.copy()
+    centre[ends[closed]] = 0
+    centre_counts = np.add.reduceat(centre, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centre_lats = np.add.reduceat(np.where(centre, lats, 0.0), starts) / centre_counts
+        centre_lons = np.add.reduceat(np.where(centre, lons, 0.0), starts) / centre_counts
+    missing = counts - np.add.reduceat(found, starts)
+
+    rows = []
+    columns = zip(way_ids, lengths.tolist(), min_lats.tolist(), min_lons.tolist(),
+                  max_lats.tolist(), max_lons.tolist(), centre_lats.tolist(),
+                  centre_lons.tolist(), missing.tolist(), counts.tolist())
+    for way_id, length, *values, n_missing, n in columns:
+        if n_missing == n:
+            rows.append((way_id, None, None, None, None, None, None, None, n_missing))
+        else:
+            rows.append((way_id, length) + tuple(values) + (n_missing,))
+    return rows
+
+
+class WayGeometry(object):
+    """Collects ways and writes their way_geometry rows in batches
+
+    nodes is the NodeStore of the conversion (or one loaded, possibly
+    memory-mapped, with NodeStore.load); writer takes tuples in
+    WAY_GEOMETRY_FIELDS order through writetuples.
+    """
+
+    def __init__(self, nodes, writer, batch_size=BATCH_SIZE):
+        self.nodes = nodes
+        self.writer = writer
+        self.batch_size = batch_size
+        self.way_ids = []
+        self.node_ids = []
+
+    def add(self, way_id, node_ids):
+        self.way_ids.append(way_id)
+        self.node_ids.append(node_ids)
+        if len(self.way_ids) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.way_ids:
+            return
+        # lookups need the store sorted by id; a no-op for sorted files
+        self.nodes.finish()
+        if np is not None:
+            rows = batch_rows(self.way_ids, self.node_ids, self.nodes)
+        else:
+            rows = [way_row(way_id, node_ids, self.nodes)
+                    for way_id, node_ids in zip(self.way_ids, self.node_ids)]
+        self.writer.writetuples(rows)
+        self.way_ids = []
+        self.node_ids = []